@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Compares title/meta extraction with streaming HtmlScanner against full BeautifulSoup parse.
+
+Usage: PYTHONPATH=src python development/benchmark_html_scan.py [page size KB] [iterations]
+"""
+
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+from healthcheckbot.common.htmlscan import scan_html
+
+CHUNK_SIZE = 16384
+
+
+def build_page(size_kb: int) -> bytes:
+    head = (
+        b"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Benchmark page</title>"
+        b"<meta name='description' content='Page used for benchmarking'></head><body>"
+    )
+    row = b"<div class='row'><a href='/item'>Item</a><span>Some text &amp; entity</span></div>\n"
+    return head + row * (size_kb * 1024 // len(row)) + b"</body></html>"
+
+
+def chunks(page: bytes):
+    for i in range(0, len(page), CHUNK_SIZE):
+        yield page[i : i + CHUNK_SIZE]
+
+
+def soup_title(page: bytes):
+    soup = BeautifulSoup(page, "html.parser")
+    return soup.title.string, soup.find("meta", attrs={"name": "description"})["content"]
+
+
+def scanner_title(page: bytes):
+    scanner = scan_html(chunks(page), title=True, meta=("description",))
+    return scanner.title, scanner.meta["description"]
+
+
+def main():
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    page = build_page(size_kb)
+    assert soup_title(page) == scanner_title(page)
+    print("Page size: {} KB, iterations: {}".format(len(page) // 1024, iterations))
+    for name, fn in (("BeautifulSoup", soup_title), ("HtmlScanner", scanner_title)):
+        elapsed = timeit.timeit(lambda: fn(page), number=iterations)
+        print("{:<15} {:10.3f} ms per page".format(name, elapsed / iterations * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,26 +14,88 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+from typing import Iterator, NamedTuple, Optional
+
 import requests
-from bs4 import BeautifulSoup
 
 from healthcheckbot.common import validators
+from healthcheckbot.common.document import get_document
+from healthcheckbot.common.htmlscan import scan_html, iter_decoded, ElementSelector
+from healthcheckbot.common.http import iter_body
 from healthcheckbot.common.model import WatcherAssert, ValidationReporter, ParameterDef
+from healthcheckbot.common.patterns import MultiPatternMatcher
+
+_CHARSET_RE = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+class ResponseContent(NamedTuple):
+    """
+    Part of the response shipped to assertions executed in process pool
+    """
+
+    content: bytes
+
 
+def get_declared_encoding(state) -> Optional[str]:
+    """
+    Returns charset declared in Content-Type header. Unlike requests it doesn't assume ISO-8859-1 for text types.
+    """
+    headers = getattr(state, "headers", None)
+    match = _CHARSET_RE.search(headers.get("content-type", "")) if headers else None
+    return match.group(1) if match else None
 
-class TitleAssert(WatcherAssert):
+
+class HtmlScanAssert(WatcherAssert):
+    """
+    Base class for assertions extracting data from HTML with streaming scanner. Body is read only till the
+    requested data is found, results are cached per check.
+    """
+
+    def scan(self, state, title: bool = False, meta=(), selectors=()):
+        key = "html_scan:{}:{}:{}".format(title, ",".join(meta), ",".join(selectors))
+        return get_document(state).get(
+            key, lambda: scan_html(iter_body(state), title, meta, selectors, get_declared_encoding(state))
+        )
+
+    def get_process_state(self, state: requests.Response) -> ResponseContent:
+        return ResponseContent(state.content)
+
+
+class TitleAssert(HtmlScanAssert):
     def __init__(self, application):
         super().__init__(application)
         self.expected_title = None
 
+    @staticmethod
+    def read_head(state: requests.Response) -> bytes:
+        """
+        Reads the body till the end of title element, the rest of the body is not downloaded when streamed
+        """
+        head = bytearray()
+        for chunk in iter_body(state):
+            search_from = max(0, len(head) - 8)
+            head += chunk
+            if head.find(b"</title", search_from) >= 0 or head.find(b"</TITLE", search_from) >= 0:
+                break
+        return bytes(head)
+
+    def get_title(self, state: requests.Response) -> Optional[str]:
+        """
+        Title is extracted once per check and shared by all title assertions of the watcher
+        """
+        return self.scan(state, title=True).title
+
+    def get_process_state(self, state: requests.Response) -> ResponseContent:
+        return ResponseContent(self.read_head(state))
+
     def do_assert(
         self,
         state: requests.Response,
         reporter: ValidationReporter,
         assertion_name: str,
     ):
-        soup = BeautifulSoup(state.content, "html.parser")
-        actual_title = soup.title.string if soup.title else None
+        actual_title = self.get_title(state)
         if actual_title != self.expected_title:
             reporter.error(
                 assertion_name,
@@ -41,3 +103,114 @@ class TitleAssert(WatcherAssert):
             )
 
     PARAMS = (ParameterDef("expected_title", is_required=True, validators=(validators.string,)),)
+
+
+class MetaAssert(HtmlScanAssert):
+    """
+    Checks meta tag identified by name, property or http-equiv attribute. If expected_content isn't set only
+    presence of the tag is verified.
+    """
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.meta_name = None
+        self.expected_content = None
+
+    def do_assert(self, state: requests.Response, reporter: ValidationReporter, assertion_name: str):
+        meta_name = self.meta_name.lower()
+        actual = self.scan(state, meta=(meta_name,)).meta.get(meta_name)
+        if actual is None:
+            reporter.error(assertion_name, 'Meta "{}" not found'.format(self.meta_name))
+        elif self.expected_content is not None and actual != self.expected_content:
+            reporter.error(
+                assertion_name,
+                'Expected meta "{}" is "{}" but actual is "{}"'.format(self.meta_name, self.expected_content, actual),
+            )
+
+    PARAMS = (
+        ParameterDef("meta_name", is_required=True, validators=(validators.string,)),
+        ParameterDef("expected_content", validators=(validators.string,)),
+    )
+
+
+class ElementAssert(HtmlScanAssert):
+    """
+    Checks the first element matching selector ("tag", "#id", ".class", "tag#id" or "tag.class"). If expected_text
+    is set, text of the element (with surrounding whitespace stripped) must be equal to it.
+    """
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.selector = None
+        self.expected_text = None
+
+    def validate(self):
+        super().validate()
+        ElementSelector(self.selector)
+
+    def do_assert(self, state: requests.Response, reporter: ValidationReporter, assertion_name: str):
+        actual = self.scan(state, selectors=(self.selector,)).elements.get(self.selector)
+        if actual is None:
+            reporter.error(assertion_name, 'Element "{}" not found'.format(self.selector))
+        elif self.expected_text is not None and actual.strip() != self.expected_text:
+            reporter.error(
+                assertion_name,
+                'Expected text of "{}" is "{}" but actual is "{}"'.format(self.selector, self.expected_text, actual),
+            )
+
+    PARAMS = (
+        ParameterDef("selector", is_required=True, validators=(validators.string,)),
+        ParameterDef("expected_text", validators=(validators.string,)),
+    )
+
+
+class BodyContentAssert(WatcherAssert):
+    """
+    Checks that body contains all of the required patterns and none of the forbidden ones. Patterns are literal
+    strings unless regex option is set. All patterns are matched in a single pass over the (streamed) body.
+    """
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.required = []
+        self.forbidden = []
+        self.regex = False
+        self.ignore_case = False
+        # Max length of regex match, used to find matches crossing chunk boundaries
+        self.max_match_length = 1024
+        self.__matcher = None  # type: Optional[MultiPatternMatcher]
+
+    def validate(self):
+        super().validate()
+        if not self.required and not self.forbidden:
+            raise ValueError("At least one of required or forbidden patterns must be set")
+        try:
+            self.__matcher = MultiPatternMatcher(
+                list(self.required) + list(self.forbidden), self.regex, self.ignore_case, self.max_match_length
+            )
+        except re.error as e:
+            raise ValueError("Invalid pattern: {}".format(e))
+
+    @staticmethod
+    def iter_text(state) -> Iterator[str]:
+        return iter_decoded(iter_body(state), get_declared_encoding(state))
+
+    def get_process_state(self, state: requests.Response) -> ResponseContent:
+        return ResponseContent(state.content)
+
+    def do_assert(self, state: requests.Response, reporter: ValidationReporter, assertion_name: str):
+        found = self.__matcher.scan(self.iter_text(state))
+        required_count = len(self.required)
+        for i, pattern in enumerate(self.__matcher.patterns):
+            if i < required_count and i not in found:
+                reporter.error(assertion_name, 'Required pattern "{}" not found'.format(pattern))
+            elif i >= required_count and i in found:
+                reporter.error(assertion_name, 'Forbidden pattern "{}" found'.format(pattern))
+
+    PARAMS = (
+        ParameterDef("required", validators=(lambda x: isinstance(x, list) and all(validators.string(p) for p in x),)),
+        ParameterDef("forbidden", validators=(lambda x: isinstance(x, list) and all(validators.string(p) for p in x),)),
+        ParameterDef("regex", validators=(validators.boolean,)),
+        ParameterDef("ignore_case", validators=(validators.boolean,)),
+        ParameterDef("max_match_length", validators=(validators.integer,)),
+    )
@@ -24,6 +24,7 @@ import os
 
 from healthcheckbot import app
 from healthcheckbot.common import bootstrap
+from healthcheckbot.common.core import ENGINES
 from healthcheckbot.common.model import CliExtension
 from healthcheckbot.common.utils import CLI
 
@@ -99,8 +100,21 @@ class ApplicationRunCLIExtension(CliExtension):
     COMMAND_NAME = "run"
     COMMAND_DESCRIPTION = "Run Healthcheck Bot in foreground"
 
+    @classmethod
+    def setup_parser(cls, parser: argparse.ArgumentParser):
+        parser.add_argument(
+            "--engine",
+            dest="engine",
+            choices=ENGINES,
+            required=False,
+            help="Execution engine, overrides app/engine config option",
+            default=None,
+        )
+
     def handle(self, args):
         global _config
+        if args.engine is not None:
+            self.get_application_manager().get_instance_settings().engine = args.engine
         bootstrapped_app = bootstrap.bootstrap_from_cli(_config, self.get_application_manager())
         app.run_application(_config, bootstrapped_app)
 
@@ -22,7 +22,9 @@ from typing import Callable, List
 import os
 import yaml
 
-from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common import validators
+from healthcheckbot.common.core import ApplicationManager, ENGINES
+from healthcheckbot.common.dispatch import OVERFLOW_POLICIES
 from healthcheckbot.common.error import ConfigValidationError
 from healthcheckbot.common.evaluator import simple_env_evaluator
 from healthcheckbot.common.model import Module, WatcherModule
@@ -77,11 +79,41 @@ def add_expression_evaluator(config_section: dict) -> EvaluatingConfigWrapper:
     return EvaluatingConfigWrapper(config_section, simple_env_evaluator)
 
 
+def _positive_integer(value):
+    return validators.integer(value) and value > 0
+
+
+def _non_negative_number(value):
+    return validators.number(value) and value >= 0
+
+
+# Instance settings configurable in "app" section: name, validator, error message
+APP_OPTIONS = (
+    ("max_workers", _positive_integer, "Must be positive integer"),
+    ("process_pool_workers", lambda x: x is None or _positive_integer(x), "Must be positive integer"),
+    ("engine", lambda x: x in ENGINES, "Must be one of: " + ", ".join(ENGINES)),
+    ("output_queue_size", _positive_integer, "Must be positive integer"),
+    ("output_workers", _positive_integer, "Must be positive integer"),
+    ("output_overflow_policy", lambda x: x in OVERFLOW_POLICIES, "Must be one of: " + ", ".join(OVERFLOW_POLICIES)),
+    ("output_flush_timeout", _non_negative_number, "Must be non-negative number"),
+    ("output_metrics_interval", _non_negative_number, "Must be non-negative number"),
+    ("http_pool_size", _positive_integer, "Must be positive integer"),
+    ("http_pool_idle_timeout", _non_negative_number, "Must be non-negative number"),
+    ("dns_cache_ttl", _non_negative_number, "Must be non-negative number"),
+    ("dns_negative_ttl", _non_negative_number, "Must be non-negative number"),
+)
+
+
 def save_instance_config(config: dict, application: ApplicationManager):
     if "app" in config:
         app_config = add_expression_evaluator(config.get("app", {}))
         settings = application.get_instance_settings()
         settings.id = app_config.get("id", "healthcheckbot0")
+        for option, is_valid, message in APP_OPTIONS:
+            value = app_config.get(option, getattr(settings, option))
+            if not is_valid(value):
+                raise ConfigValidationError("app/" + option, message)
+            setattr(settings, option, value)
         # Context Path
         for path in app_config.get("classpath", []):
             if isinstance(path, str):
@@ -116,7 +148,7 @@ def instantiate_modules_for_section(
         instance = application.register_module_instance(instance_name_prefix + name, module_def.get("provider"))
         try:
             # Parse and set parameters
-            for param_def in instance.PARAMS:
+            for param_def in tuple(instance.MODULE_LEVEL_PARAMS) + tuple(instance.PARAMS):
                 if param_def.name in module_def:
                     val = module_def.get(param_def.name)
                     if param_def.parser is not None:
@@ -150,6 +182,7 @@ def instantiate_modules_for_section(
 
 
 def _register_watcher_module(application: ApplicationManager, watcher: WatcherModule, module_def: dict):
+    watcher.compile_assertions()
     for trigger_name in module_def.get("triggers", tuple()):
         trigger = application.get_trigger_by_name(trigger_name)
         if trigger is None:
@@ -14,17 +14,27 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import functools
 import logging
-import time
-from typing import List, Tuple, Type, NamedTuple, Dict
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Tuple, Type, NamedTuple, Dict, Optional
 
 from healthcheckbot.common.error import (
+    ExecutionTimeoutError,
     InvalidModuleError,
     WatcherRuntimeError,
     OutputRuntimeError,
 )
 from healthcheckbot.common.model import (
+    AssertionOutcome,
+    AsyncOutputModule,
+    AsyncWatcherModule,
     CliExtension,
+    CompositeState,
     Module,
     TriggerModule,
     OutputModule,
@@ -34,6 +44,8 @@ from healthcheckbot.common.model import (
     LoopModuleMixin,
     WatcherAssert,
 )
+from healthcheckbot.common.dispatch import OutputDispatcher, OutputLane, OVERFLOW_DROP_OLDEST
+from healthcheckbot.common.scheduler import Scheduler, ScheduledCall
 
 
 class ModuleType(NamedTuple):
@@ -42,11 +54,115 @@ class ModuleType(NamedTuple):
     base_class: Type
 
 
+def obtain_state_in_process(watcher: WatcherModule) -> object:
+    """
+    Entry point of obtain_state executed in process pool. Trigger is not available in worker process.
+    """
+    return watcher.obtain_state(None)
+
+
+def assert_in_process(assertion: WatcherAssert, state: object) -> Tuple[List, dict]:
+    """
+    Entry point of the assertion executed in process pool.
+
+    :return: tuple of reported validation errors and extra data
+    """
+    reporter = ValidationReporter(None, None)
+    assertion.do_assert(state, reporter, assertion.name)
+    return reporter.errors, reporter.extra_data
+
+
+ENGINE_THREADS = "threads"
+ENGINE_ASYNCIO = "asyncio"
+ENGINES = (ENGINE_THREADS, ENGINE_ASYNCIO)
+
+
 class InstanceSettings:
     def __init__(self):
         self.id = None
         self.enable_cli = False
         self.context_path = []
+        # Max number of watchers executed at the same time by the shared worker pool
+        self.max_workers = 10
+        # Max number of idle HTTP sessions retained per host and their idle timeout in seconds
+        self.http_pool_size = 10
+        self.http_pool_idle_timeout = 60
+        # Seconds to cache resolved and failed to resolve host names, 0 disables DNS cache
+        self.dns_cache_ttl = 60
+        self.dns_negative_ttl = 5
+        # Size of the pool for modules running in separate process, None means number of CPUs
+        self.process_pool_workers = None  # type: Optional[int]
+        # Execution engine, one of ENGINES
+        self.engine = ENGINE_THREADS
+        # Output dispatch pipeline, queue and workers are allocated for each output
+        self.output_queue_size = 1000
+        self.output_workers = 1
+        self.output_overflow_policy = OVERFLOW_DROP_OLDEST
+        self.output_flush_timeout = 10
+        # Interval in seconds for reporting output pipeline metrics, 0 disables reporting
+        self.output_metrics_interval = 60
+
+
+class WatcherRun:
+    """
+    Single execution of the watcher. Holds the future exposed to the trigger along with timeout and cancellation
+    state. Once run is finished (or timed out) all later outcomes are ignored.
+
+    Timed out run might still occupy pool threads, completed future is resolved once all of them are done.
+    """
+
+    def __init__(self, watcher: WatcherModule, trigger: TriggerModule) -> None:
+        self.watcher = watcher
+        self.trigger = trigger
+        self.future = Future()  # type: Future
+        self.completed = Future()  # type: Future
+        # Future of the underlying task (pool job or asyncio task)
+        self.task = None  # type: Optional[Future]
+        self.timeout_call = None  # type: Optional[ScheduledCall]
+        self.cancelled = False
+        self.__lock = threading.Lock()
+        # Run is held by the submitter until the task is registered
+        self.__holds = 1
+
+    def hold(self, future: Future):
+        """
+        Keeps run incomplete until the given future (pool job or task) is done
+        """
+        with self.__lock:
+            self.__holds += 1
+        future.add_done_callback(lambda f: self.release())
+
+    def release(self):
+        with self.__lock:
+            self.__holds -= 1
+            if self.__holds > 0:
+                return
+        self.completed.set_result(None)
+
+    def finish(self, result: WatcherResult = None, error: BaseException = None) -> bool:
+        with self.__lock:
+            if self.future.done():
+                return False
+            if self.timeout_call is not None:
+                self.timeout_call.cancel()
+            if error is None:
+                self.future.set_result(result)
+            else:
+                self.future.set_exception(error)
+            return True
+
+    def cancel(self, error: BaseException):
+        """
+        Resolves run with the given error and cancels underlying task. Pool thread can't be interrupted, so
+        in this case run is just abandoned - its outcome won't be delivered.
+        """
+        self.cancelled = True
+        if self.finish(error=error) and self.task is not None:
+            self.task.cancel()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise ExecutionTimeoutError("Run of watcher {} was cancelled".format(self.watcher.name))
 
 
 class ApplicationManager:
@@ -60,6 +176,15 @@ class ApplicationManager:
         self.__watchers = {}  # type: Dict[WatcherModule]
         self.__watcher_asserts = {}  # type: Dict[WatcherAssert]
         self.__main_loop = []  # type: List[LoopModuleMixin]
+        self.__executor = None  # type: Optional[ThreadPoolExecutor]
+        self.__process_pool = None  # type: Optional[ProcessPoolExecutor]
+        self.__evaluation_executor = None  # type: Optional[ThreadPoolExecutor]
+        self.__scheduler = Scheduler()
+        self.__loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self.__output_dispatcher = None  # type: Optional[OutputDispatcher]
+        self.__reported_dropped = {}  # type: Dict[str, int]
+        self.__shared_resources = {}  # type: Dict[str, object]
+        self.__shared_resources_lock = threading.Lock()
 
     def __module_by_class_or_class_name(self, class_name):
         if isinstance(class_name, str):
@@ -101,6 +226,11 @@ class ApplicationManager:
         try:
             module_class = self.__module_by_class_or_class_name(class_name)
             module_type = self.__bucket_for_module_instance(module_class)
+            if (
+                issubclass(module_class, (AsyncWatcherModule, AsyncOutputModule))
+                and self.__instance_settings.engine != ENGINE_ASYNCIO
+            ):
+                raise InvalidModuleError("Module requires {} engine".format(ENGINE_ASYNCIO))
             module_inst = module_class(self)
             try:
                 module_inst.on_initialized()
@@ -123,33 +253,301 @@ class ApplicationManager:
     def get_instance_settings(self) -> InstanceSettings:
         return self.__instance_settings
 
+    def get_scheduler(self) -> Scheduler:
+        return self.__scheduler
+
+    def __step_loop_module(self, module: LoopModuleMixin):
+        try:
+            module.step()
+        finally:
+            if not self.__terminating:
+                self.__scheduler.call_later(module.step_interval, self.__step_loop_module, module)
+
+    def get_output_dispatcher(self) -> OutputDispatcher:
+        if self.__output_dispatcher is None:
+            settings = self.__instance_settings
+            dispatcher = OutputDispatcher()
+            for output_name, output in self.__outputs.items():
+                dispatcher.add_lane(
+                    OutputLane(
+                        output_name,
+                        functools.partial(self.__deliver_to_output, output),
+                        queue_size=settings.output_queue_size,
+                        workers=settings.output_workers,
+                        overflow_policy=settings.output_overflow_policy,
+                        batch_size=output.batch_size,
+                        batch_linger=output.batch_linger,
+                        max_retries=output.max_retries,
+                        retry_delay=output.retry_delay,
+                    )
+                )
+            self.__output_dispatcher = dispatcher
+        return self.__output_dispatcher
+
+    def __report_output_metrics(self):
+        for lane_name, metrics in self.get_output_dispatcher().get_metrics().items():
+            message = 'Output "{}" metrics: '.format(lane_name) + ", ".join(
+                "{}={}".format(k, v) for k, v in metrics.items()
+            )
+            if metrics["dropped"] > self.__reported_dropped.get(lane_name, 0):
+                self.__logger.warning(message)
+            else:
+                self.__logger.debug(message)
+            self.__reported_dropped[lane_name] = metrics["dropped"]
+        if not self.__terminating:
+            self.__scheduler.call_later(self.__instance_settings.output_metrics_interval, self.__report_output_metrics)
+
     def main_loop(self):
+        for module in self.__main_loop:
+            self.__scheduler.call_soon(self.__step_loop_module, module)
+        if self.__instance_settings.output_metrics_interval > 0:
+            self.__scheduler.call_later(self.__instance_settings.output_metrics_interval, self.__report_output_metrics)
+        if self.__instance_settings.engine == ENGINE_ASYNCIO:
+            self.__run_async_main_loop()
+        else:
+            self.__threaded_main_loop()
+
+    def __run_async_main_loop(self):
+        # asyncio.run is not available in python 3.6
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.__async_main_loop())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def __threaded_main_loop(self):
         while not self.__terminating:
-            for module in self.__main_loop:
+            timeout = self.__scheduler.run_pending()
+            if self.__terminating:
+                break
+            self.__scheduler.wait(timeout)
+
+    async def __async_main_loop(self):
+        self.__loop = asyncio.get_event_loop()
+        woken = asyncio.Event()
+        self.__scheduler.set_waker(lambda: self.__loop.call_soon_threadsafe(woken.set))
+        try:
+            while not self.__terminating:
+                timeout = self.__scheduler.run_pending()
+                if self.__terminating:
+                    break
                 try:
-                    module.step()
-                except Exception as e:
-                    self.__logger.error("Error in during main loop execution: " + str(e))
-            time.sleep(0.01)
+                    await asyncio.wait_for(woken.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                woken.clear()
+        finally:
+            # Async outputs need running loop, so pending results are flushed before it is stopped
+            await self.__loop.run_in_executor(
+                None, self.get_output_dispatcher().flush, self.__instance_settings.output_flush_timeout
+            )
+            self.__scheduler.set_waker(None)
+            self.__loop = None
 
-    def run_watcher(self, watcher: WatcherModule, trigger: TriggerModule) -> WatcherResult:
-        reporter = ValidationReporter(watcher, trigger)
+    def get_executor(self) -> Executor:
+        """
+        Returns worker pool shared by all triggers which do not define their own one.
+        """
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=self.__instance_settings.max_workers, thread_name_prefix="watcher"
+            )
+        return self.__executor
+
+    def get_shared_resource(self, name: str, factory: Callable[[], object]):
+        """
+        Returns resource shared by modules (connection pools, caches), creates it with factory on the first call.
+        Resources having close() method are closed on shutdown.
+        """
+        with self.__shared_resources_lock:
+            if name not in self.__shared_resources:
+                self.__shared_resources[name] = factory()
+            return self.__shared_resources[name]
+
+    def get_process_pool(self) -> Executor:
+        """
+        Returns process pool used by watchers and assertions with run_in_process option enabled.
+        """
+        with self.__shared_resources_lock:
+            if self.__process_pool is None:
+                kwargs = {}
+                if sys.version_info >= (3, 7):
+                    # Forking the process with running threads might copy locks held by them, so workers are started
+                    # from a clean process. Python 3.6 doesn't support start method selection for the pool.
+                    start_methods = multiprocessing.get_all_start_methods()
+                    kwargs["mp_context"] = multiprocessing.get_context(
+                        "forkserver" if "forkserver" in start_methods else "spawn"
+                    )
+                self.__process_pool = ProcessPoolExecutor(
+                    max_workers=self.__instance_settings.process_pool_workers, **kwargs
+                )
+            return self.__process_pool
+
+    def submit_watcher(self, watcher: WatcherModule, trigger: TriggerModule, executor: Executor = None) -> Future:
+        """
+        Schedules watcher execution in the worker pool.
+
+        :param executor: pool to be used instead of the shared one
+        :return: future which will be resolved with WatcherResult or exception raised during the run
+        """
+        return self.start_watcher_run(watcher, trigger, executor).future
+
+    def start_watcher_run(
+        self, watcher: WatcherModule, trigger: TriggerModule, executor: Executor = None
+    ) -> WatcherRun:
+        """
+        Schedules watcher execution in the worker pool. Unlike submit_watcher gives access to the run completion,
+        which happens after timeout once abandoned pool threads are done.
+        """
+        if executor is None:
+            executor = self.get_executor()
+        run = WatcherRun(watcher, trigger)
+        if self.__loop is not None:
+            run.task = asyncio.run_coroutine_threadsafe(self.__execute_run_async(run, executor), self.__loop)
+        else:
+            run.task = executor.submit(self.__execute_run, run)
+        run.hold(run.task)
+        run.release()
+        return run
+
+    def __start_run_timeout(self, run: WatcherRun):
+        # Timeout is counted from the actual start, time spent in the pool queue doesn't count
+        run.timeout_call = self.__scheduler.call_later(run.watcher.execution_timeout, self.__on_run_timeout, run)
+
+    def __on_run_timeout(self, run: WatcherRun):
+        run.cancel(
+            ExecutionTimeoutError(
+                "Timed out for operation Execution watcher timeout ({}s)".format(run.watcher.execution_timeout)
+            )
+        )
+
+    def __execute_run(self, run: WatcherRun):
+        if run.cancelled:
+            return
+        self.__start_run_timeout(run)
         try:
-            state = watcher.obtain_state(trigger)
+            run.finish(self.run_watcher(run.watcher, run.trigger, run))
+        except Exception as e:
+            run.finish(error=e)
+
+    async def __execute_run_async(self, run: WatcherRun, executor: Executor):
+        if not isinstance(run.watcher, AsyncWatcherModule):
+            # Sync watcher runs in the worker as a whole like in threads engine, timeout starts once worker picks it
+            await self.__run_in_executor(executor, run, self.__execute_run, run)
+            return
+        self.__start_run_timeout(run)
+        try:
+            run.finish(await self.run_watcher_async(run.watcher, run.trigger, self.__get_evaluation_executor(), run))
+        except Exception as e:
+            run.finish(error=e)
+
+    @staticmethod
+    async def __run_in_executor(executor: Executor, run: Optional[WatcherRun], fn: Callable, *args):
+        # Unlike loop.run_in_executor keeps the run incomplete until the thread is done even if awaiting is cancelled
+        future = executor.submit(fn, *args)
+        if run is not None:
+            run.hold(future)
+        return await asyncio.wrap_future(future)
+
+    def __get_evaluation_executor(self) -> Executor:
+        # Evaluation of async watchers shouldn't wait in the queue behind blocking watchers
+        if self.__evaluation_executor is None:
+            self.__evaluation_executor = ThreadPoolExecutor(
+                max_workers=self.__instance_settings.max_workers, thread_name_prefix="evaluate"
+            )
+        return self.__evaluation_executor
+
+    def run_watcher(self, watcher: WatcherModule, trigger: TriggerModule, run: WatcherRun = None) -> WatcherResult:
+        """
+        :param run: if given, result won't be delivered in case run was cancelled before the end of execution
+        :return: watcher result or list of results (one per target) if watcher returned CompositeState
+        """
+        try:
+            if watcher.run_in_process:
+                state = self.get_process_pool().submit(obtain_state_in_process, watcher).result()
+            else:
+                state = watcher.obtain_state(trigger)
+        except Exception as e:
+            raise WatcherRuntimeError(
+                'Watcher "{}" was unable to finish obtain state cycle: {}'.format(watcher.name, str(e)),
+                e,
+            )
+        if run is not None:
+            run.check_cancelled()
+        watcher_result = self.__evaluate(watcher, trigger, state)
+        if run is not None:
+            run.check_cancelled()
+        for result in watcher_result if isinstance(watcher_result, list) else (watcher_result,):
+            self.deliver_watcher_result(watcher, result)
+        return watcher_result
+
+    async def run_watcher_async(
+        self, watcher: WatcherModule, trigger: TriggerModule, executor: Executor = None, run: WatcherRun = None
+    ) -> WatcherResult:
+        """
+        Asyncio engine counterpart of run_watcher. Blocking parts (sync watchers and outputs, assertions)
+        are executed in the given executor.
+        """
+        if executor is None:
+            executor = self.get_executor()
+        try:
+            if watcher.run_in_process:
+                state = await self.__run_in_executor(self.get_process_pool(), run, obtain_state_in_process, watcher)
+            elif isinstance(watcher, AsyncWatcherModule):
+                state = await watcher.obtain_state(trigger)
+            else:
+                state = await self.__run_in_executor(executor, run, watcher.obtain_state, trigger)
         except Exception as e:
             raise WatcherRuntimeError(
                 'Watcher "{}" was unable to finish obtain state cycle: {}'.format(watcher.name, str(e)),
                 e,
             )
+        if run is not None:
+            run.check_cancelled()
+        watcher_result = await self.__run_in_executor(executor, run, self.__evaluate, watcher, trigger, state)
+        if run is not None:
+            run.check_cancelled()
+        for result in watcher_result if isinstance(watcher_result, list) else (watcher_result,):
+            await self.deliver_watcher_result_async(watcher, result, executor)
+        return watcher_result
+
+    def __evaluate(self, watcher: WatcherModule, trigger: TriggerModule, state):
+        if isinstance(state, CompositeState):
+            return [self.__evaluate_target(watcher, trigger, *item) for item in state.items]
+        return self.__evaluate_state(watcher, ValidationReporter(watcher, trigger), state)
+
+    def __evaluate_target(
+        self, watcher: WatcherModule, trigger: TriggerModule, target: str, state, error: Exception = None
+    ) -> WatcherResult:
+        # Failure of a single target shouldn't affect the others, so it is reported as a failed check
+        reporter = ValidationReporter(watcher, trigger)
+        reporter.extra("target", target)
+        if error is not None:
+            reporter.error("obtain_state", str(error))
+            return WatcherResult(None, reporter.errors, reporter.extra_data)
+        try:
+            return self.__evaluate_state(watcher, reporter, state)
+        except WatcherRuntimeError as e:
+            reporter.error("evaluate_state", e.message)
+            return WatcherResult(None, reporter.errors, reporter.extra_data)
+
+    def __evaluate_state(self, watcher: WatcherModule, reporter: ValidationReporter, state) -> WatcherResult:
+        try:
+            return self.__check_state(watcher, reporter, state)
+        finally:
+            if state is not None:
+                try:
+                    watcher.release_state(state)
+                except Exception as e:
+                    self.__logger.error('Watcher "{}" was unable to release state: {}'.format(watcher.name, e))
+
+    def __check_state(self, watcher: WatcherModule, reporter: ValidationReporter, state) -> WatcherResult:
         if watcher.enable_assertions:
             try:
-                watcher.do_assertions(state, reporter)
-                for assertion in watcher.custom_assertions:
-                    try:
-                        assertion.do_assert(state, reporter, assertion.name)
-                    except Exception as e:
-                        reporter.error(assertion.name, "Unexpected error: " + str(e))
-
+                self.__run_assertions(watcher, reporter, state)
             except Exception as e:
                 raise WatcherRuntimeError(
                     'Watcher "{}" was unable to run assertions check: {}'.format(watcher.name, str(e)),
@@ -163,22 +561,83 @@ class ApplicationManager:
                 'Watcher "{}" was unable serialize state: {}'.format(watcher.name, str(e)),
                 e,
             )
-        self.deliver_watcher_result(watcher, watcher_result)
         return watcher_result
 
-    def deliver_watcher_result(self, watcher: WatcherModule, watcher_result: WatcherResult):
-        for output_name, output in self.__outputs.items():
+    def __run_assertions(self, watcher: WatcherModule, reporter: ValidationReporter, state):
+        # Outcome of declarative and custom assertions is reused if watcher knows the content hasn't changed
+        replayed = watcher.replay_assertions(state)
+        # Assertions running in process pool are started first to run in parallel with the others
+        process_runs = {}
+        for assertion in watcher.custom_assertions if replayed is None else ():
+            if assertion.run_in_process:
+                process_runs[assertion.name] = self.get_process_pool().submit(
+                    assert_in_process, assertion, assertion.get_process_state(state)
+                )
+        watcher.do_assertions(state, reporter)
+        if replayed is None:
+            content_reporter = ValidationReporter(watcher, reporter.trigger)
+            self.__run_assertion_plan(watcher, content_reporter, state)
+            for assertion in watcher.custom_assertions:
+                try:
+                    if assertion.name in process_runs:
+                        errors, extra = process_runs[assertion.name].result()
+                        content_reporter.errors.extend(errors)
+                        content_reporter.extra_data.update(extra)
+                    else:
+                        assertion.do_assert(state, content_reporter, assertion.name)
+                except Exception as e:
+                    content_reporter.error(assertion.name, "Unexpected error: " + str(e))
+            replayed = AssertionOutcome(tuple(content_reporter.errors), dict(content_reporter.extra_data))
+            watcher.remember_assertions(state, replayed)
+        reporter.errors.extend(replayed.errors)
+        reporter.extra_data.update(replayed.extra)
+
+    @staticmethod
+    def __run_assertion_plan(watcher: WatcherModule, reporter: ValidationReporter, state):
+        for rule in watcher.assertion_plan:
             try:
-                output.output(watcher, watcher_result)
+                rule.check(state, reporter)
             except Exception as e:
-                raise OutputRuntimeError(
-                    'Unable to deliver watcher result via output "{}": {}'.format(output.name, str(e)),
-                    e,
-                )
+                reporter.error(rule.name, "Unexpected error: " + str(e))
+
+    def deliver_watcher_result(self, watcher: WatcherModule, watcher_result: WatcherResult):
+        """
+        Puts result into output dispatch queue. Depending on overflow policy it might block if queue is full.
+        """
+        self.get_output_dispatcher().submit(watcher, watcher_result)
+
+    def __deliver_to_output(self, output: OutputModule, results: List[Tuple[WatcherModule, WatcherResult]]):
+        try:
+            if isinstance(output, AsyncOutputModule):
+                loop = self.__loop
+                if loop is None:
+                    raise RuntimeError("event loop is not running")
+                asyncio.run_coroutine_threadsafe(output.output_batch(results), loop).result()
+            else:
+                output.output_batch(results)
+        except Exception as e:
+            raise OutputRuntimeError(
+                'Unable to deliver watcher result via output "{}": {}'.format(output.name, str(e)),
+                e,
+            )
+
+    async def deliver_watcher_result_async(
+        self, watcher: WatcherModule, watcher_result: WatcherResult, executor: Executor = None
+    ):
+        await asyncio.get_event_loop().run_in_executor(executor, self.deliver_watcher_result, watcher, watcher_result)
 
     def shutdown(self):
         self.__logger.info("Initiating shutdown process")
         self.__terminating = True
+        self.__scheduler.wake()
+        if self.__output_dispatcher is not None:
+            self.__output_dispatcher.stop(self.__instance_settings.output_flush_timeout)
+            for lane_name, metrics in self.__output_dispatcher.get_metrics().items():
+                self.__logger.info(
+                    'Output "{}" stopped, delivered {}, failed {}, dropped {}'.format(
+                        lane_name, metrics["delivered"], metrics["failed"], metrics["dropped"]
+                    )
+                )
         for bucket in (
             self.__watchers,
             self.__triggers,
@@ -195,3 +654,18 @@ class ApplicationManager:
                 finally:
                     del module
         self.__logger.info("Destroyed modules")
+        self.__release_resources()
+
+    def __release_resources(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        if self.__evaluation_executor is not None:
+            self.__evaluation_executor.shutdown(wait=False)
+        if self.__process_pool is not None:
+            self.__process_pool.shutdown(wait=False)
+        for name, resource in self.__shared_resources.items():
+            if hasattr(resource, "close"):
+                try:
+                    resource.close()
+                except Exception as e:
+                    self.__logger.error("Error while closing shared resource {}: {}".format(name, e))
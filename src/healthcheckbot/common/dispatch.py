@@ -0,0 +1,307 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Optional, Any, Dict, List, Tuple
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class DispatchQueue:
+    """
+    Bounded FIFO queue with configurable behaviour on overflow:
+
+    * block - producer waits until there is free space
+    * drop_oldest - the oldest queued item is discarded to free space for the new one
+    * drop_newest - the new item is discarded
+    """
+
+    def __init__(self, max_size: int, overflow_policy: str = OVERFLOW_BLOCK) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy must be one of: " + ", ".join(OVERFLOW_POLICIES))
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.__items = collections.deque()
+        self.__condition = threading.Condition()
+        self.__unfinished = 0
+        self.__closed = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def put(self, item) -> bool:
+        """
+        :return: False if item was dropped
+        """
+        with self.__condition:
+            if self.__closed:
+                self.dropped += 1
+                return False
+            if len(self.__items) >= self.max_size:
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self.__items.popleft()
+                    self.__unfinished -= 1
+                    self.dropped += 1
+                else:
+                    while len(self.__items) >= self.max_size and not self.__closed:
+                        self.__condition.wait()
+                    if self.__closed:
+                        self.dropped += 1
+                        return False
+            self.__items.append(item)
+            self.__unfinished += 1
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self.__items))
+            self.__condition.notify_all()
+            return True
+
+    def get(self, timeout: float = None) -> Optional[Any]:
+        """
+        :return: the oldest item or None if timeout expired or queue was closed
+        """
+        with self.__condition:
+            if not self.__items and not self.__closed:
+                self.__condition.wait(timeout)
+            if not self.__items:
+                return None
+            item = self.__items.popleft()
+            self.__condition.notify_all()
+            return item
+
+    def get_batch(self, max_items: int, linger: float = 0, timeout: float = None) -> List[Any]:
+        """
+        Waits for the first item and then collects up to max_items items during linger seconds.
+
+        :return: list of items, empty if timeout expired or queue was closed
+        """
+        first = self.get(timeout)
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + linger
+        with self.__condition:
+            while len(batch) < max_items:
+                if not self.__items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.__closed:
+                        break
+                    self.__condition.wait(remaining)
+                    continue
+                batch.append(self.__items.popleft())
+            self.__condition.notify_all()
+        return batch
+
+    def task_done(self, count: int = 1):
+        with self.__condition:
+            self.__unfinished -= count
+            self.__condition.notify_all()
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits until all queued items are processed.
+
+        :return: False if timeout expired before
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while self.__unfinished > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.__condition.wait(remaining)
+            return True
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    @property
+    def closed(self):
+        return self.__closed
+
+
+class OutputLane:
+    """
+    Delivery lane of a single output: bounded queue drained by dedicated worker thread(s). Workers take results
+    from the queue in batches of up to batch_size items waiting at most batch_linger seconds for the batch to fill.
+    Failed batch is retried up to max_retries times with retry_delay seconds between attempts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        deliver_fn: Callable[[List[Tuple[Any, Any]]], None],
+        queue_size: int = 1000,
+        workers: int = 1,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        batch_size: int = 1,
+        batch_linger: float = 0,
+        max_retries: int = 0,
+        retry_delay: float = 1,
+    ) -> None:
+        """
+        :param deliver_fn: callable receiving list of (watcher instance, WatcherResult) tuples
+        """
+        self.name = name
+        self.queue = DispatchQueue(queue_size, overflow_policy)
+        self.workers_count = workers
+        self.batch_size = batch_size
+        self.batch_linger = batch_linger
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.__deliver_fn = deliver_fn
+        self.__workers = []  # type: List[threading.Thread]
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger("OutputLane")
+
+    def start(self):
+        with self.__lock:
+            if self.__workers:
+                return
+            for i in range(self.workers_count):
+                worker = threading.Thread(target=self.__work, name="output-{}-{}".format(self.name, i), daemon=True)
+                worker.start()
+                self.__workers.append(worker)
+
+    def submit(self, watcher, watcher_result) -> bool:
+        if not self.__workers:
+            self.start()
+        return self.queue.put((watcher, watcher_result))
+
+    def __work(self):
+        while True:
+            batch = self.queue.get_batch(self.batch_size, self.batch_linger)
+            if not batch:
+                if self.queue.closed:
+                    return
+                continue
+            try:
+                self.__deliver(batch)
+            finally:
+                self.queue.task_done(len(batch))
+
+    def __deliver(self, batch: List[Tuple[Any, Any]]):
+        attempt = 0
+        while True:
+            try:
+                self.__deliver_fn(batch)
+                with self.__lock:
+                    self.delivered += len(batch)
+                return
+            except Exception as e:
+                message = getattr(e, "message", str(e))
+                if attempt >= self.max_retries or self.queue.closed:
+                    with self.__lock:
+                        self.failed += len(batch)
+                    self.__logger.error("[{}] {}".format(self.name, message))
+                    return
+                attempt += 1
+                with self.__lock:
+                    self.retries += 1
+                self.__logger.warning(
+                    "[{}] {}. Retry {}/{} in {}s".format(
+                        self.name, message, attempt, self.max_retries, self.retry_delay
+                    )
+                )
+                time.sleep(self.retry_delay)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until all queued results are delivered.
+
+        :return: False if timeout expired before
+        """
+        if not self.__workers:
+            return True
+        return self.queue.join(timeout)
+
+    def close(self):
+        if len(self.queue) > 0:
+            self.__logger.warning(
+                "[{}] {} results were not delivered before shutdown".format(self.name, len(self.queue))
+            )
+        self.queue.close()
+
+    def get_metrics(self) -> Dict[str, int]:
+        return dict(
+            queue_depth=len(self.queue),
+            queue_max_depth=self.queue.max_depth,
+            queue_size=self.queue.max_size,
+            enqueued=self.queue.enqueued,
+            dropped=self.queue.dropped,
+            delivered=self.delivered,
+            failed=self.failed,
+            retries=self.retries,
+        )
+
+
+class OutputDispatcher:
+    """
+    Delivers watcher results to outputs asynchronously. Each output has its own OutputLane, so outputs work
+    in parallel and a slow or failing output doesn't delay the others.
+    """
+
+    def __init__(self) -> None:
+        self.lanes = collections.OrderedDict()  # type: Dict[str, OutputLane]
+
+    def add_lane(self, lane: OutputLane):
+        self.lanes[lane.name] = lane
+
+    def submit(self, watcher, watcher_result) -> bool:
+        """
+        :return: False if result was dropped by at least one lane
+        """
+        accepted = True
+        for lane in self.lanes.values():
+            accepted = lane.submit(watcher, watcher_result) and accepted
+        return accepted
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until all lanes deliver queued results.
+
+        :return: False if timeout expired before
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        flushed = True
+        for lane in self.lanes.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            flushed = lane.flush(remaining) and flushed
+        return flushed
+
+    def stop(self, timeout: float = None):
+        self.flush(timeout)
+        for lane in self.lanes.values():
+            lane.close()
+
+    def get_metrics(self) -> Dict[str, Dict[str, int]]:
+        return {name: lane.get_metrics() for name, lane in self.lanes.items()}
@@ -0,0 +1,117 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import ipaddress
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class DnsCache:
+    """
+    Process-wide cache of resolved host addresses. System resolver doesn't expose record TTL, so resolved addresses
+    are kept for the configured ttl seconds. Failed lookups are cached for negative_ttl seconds, so unavailable
+    resolver isn't hammered by every check. Concurrent lookups of the same host are coalesced into a single one.
+    """
+
+    def __init__(self, ttl: float = 60, negative_ttl: float = 5, max_size: int = 10000) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # host -> (expires_at, addresses, error)
+        self.__entries = collections.OrderedDict()  # type: Dict[str, Tuple[float, List[str], Optional[Exception]]]
+        self.__lock = threading.Lock()
+        self.__host_locks = {}  # type: Dict[str, threading.Lock]
+
+    @staticmethod
+    def is_ip_address(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def resolve(self, host: str) -> List[str]:
+        """
+        Returns the list of addresses for the given host. Raises socket.gaierror if host can't be resolved.
+        """
+        if self.is_ip_address(host):
+            return [host]
+        host = host.lower()
+        entry = self.__get_entry(host)
+        if entry is None:
+            with self.__lock:
+                host_lock = self.__host_locks.setdefault(host, threading.Lock())
+            with host_lock:
+                # Another thread might have resolved the host while we were waiting
+                entry = self.__get_entry(host)
+                if entry is None:
+                    entry = self.__lookup(host)
+            with self.__lock:
+                self.__host_locks.pop(host, None)
+        else:
+            self.hits += 1
+        addresses, error = entry[1], entry[2]
+        if error is not None:
+            raise socket.gaierror(*error.args)
+        return addresses
+
+    def __get_entry(self, host: str):
+        with self.__lock:
+            entry = self.__entries.get(host)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.__entries[host]
+                return None
+            return entry
+
+    def __lookup(self, host: str):
+        self.misses += 1
+        try:
+            infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+            entry = (time.monotonic() + self.ttl, list(collections.OrderedDict.fromkeys(x[4][0] for x in infos)), None)
+        except socket.gaierror as e:
+            entry = (time.monotonic() + self.negative_ttl, [], e)
+        with self.__lock:
+            self.__entries[host] = entry
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+def get_dns_cache(application) -> Optional[DnsCache]:
+    """
+    Returns DNS cache shared by all network watchers of the application or None if caching is disabled
+    (dns_cache_ttl is 0).
+
+    :type application: healthcheckbot.common.core.ApplicationManager
+    """
+    if application is None:
+        return None
+    settings = application.get_instance_settings()
+    if not settings.dns_cache_ttl:
+        return None
+    return application.get_shared_resource(
+        "dns_cache", lambda: DnsCache(settings.dns_cache_ttl, settings.dns_negative_ttl)
+    )
@@ -0,0 +1,94 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from typing import Any, Callable, Dict
+
+from bs4 import BeautifulSoup
+
+
+class ParsedDocument:
+    """
+    Lazily built representations of the response body (text, decoded JSON, HTML tree). Document is attached to the
+    state, so each representation is built at most once per check and shared by all assertions of the run.
+    """
+
+    def __init__(self, state) -> None:
+        """
+        :param state: object with content attribute (bytes), e.g. requests.Response
+        """
+        self.__state = state
+        self.__values = {}  # type: Dict[str, Any]
+        self.__errors = {}  # type: Dict[str, Exception]
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Returns value built by factory on the first call. Assertions might use it to share derived data,
+        factory errors are cached as well and raised on each access.
+        """
+        if name in self.__errors:
+            raise self.__errors[name]
+        if name not in self.__values:
+            try:
+                self.__values[name] = factory()
+            except Exception as e:
+                self.__errors[name] = e
+                raise
+        return self.__values[name]
+
+    @property
+    def content(self) -> bytes:
+        return self.__state.content or b""
+
+    @property
+    def text(self) -> str:
+        return self.get("text", self.__decode_text)
+
+    @property
+    def json(self) -> Any:
+        """
+        :raises ValueError: if body is not a valid JSON
+        """
+        return self.get("json", lambda: json.loads(self.text))
+
+    @property
+    def html(self) -> BeautifulSoup:
+        return self.get("html", lambda: BeautifulSoup(self.content, "html.parser"))
+
+    def __decode_text(self) -> str:
+        encoding = getattr(self.__state, "encoding", None)
+        if encoding is None and hasattr(self.__state, "apparent_encoding"):
+            encoding = self.__state.apparent_encoding
+        try:
+            return self.content.decode(encoding or "utf-8", errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+
+def get_document(state) -> ParsedDocument:
+    """
+    Returns parsed document cache of the given state creating it on the first call.
+    """
+    document = getattr(state, "parsed_document", None)
+    if document is None:
+        document = ParsedDocument(state)
+        try:
+            state.parsed_document = document
+        except AttributeError:
+            # Immutable states (e.g. shipped to process pool) aren't cached
+            pass
+    return document
@@ -0,0 +1,214 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import codecs
+import re
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Elements which never have content nor closing tag
+VOID_ELEMENTS = frozenset(
+    ("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr")
+)
+
+_SELECTOR_RE = re.compile(r"^([a-zA-Z][a-zA-Z0-9-]*)?(?:#([\w-]+))?(?:\.([\w-]+))?$")
+
+# Encoding declared in the document, looked up in the first ENCODING_SNIFF_BYTES bytes like browsers do
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)", re.IGNORECASE)
+_XML_ENCODING_RE = re.compile(rb"^\s*<\?xml[^>]+encoding\s*=\s*[\"']([\w.:-]+)")
+# Declarations must be in the head section, no need to wait for more bytes once it is over
+_HEAD_END_RE = re.compile(rb"</head|<body", re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+ENCODING_SNIFF_BYTES = 1024
+
+
+def _known_encoding(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def detect_encoding(head: bytes, declared: str = None) -> str:
+    """
+    Detects encoding of HTML document by the beginning of its body: byte order mark, then encoding declared in
+    Content-Type header, then meta charset or XML declaration. Falls back to UTF-8.
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    encoding = _known_encoding(declared)
+    if encoding is None:
+        match = _META_CHARSET_RE.search(head, 0, ENCODING_SNIFF_BYTES) or _XML_ENCODING_RE.search(head)
+        encoding = _known_encoding(match.group(1).decode("ascii")) if match else None
+    return encoding or "utf-8"
+
+
+def iter_decoded(chunks: Iterable[bytes], declared_encoding: str = None) -> Iterator[str]:
+    """
+    Decodes byte chunks to text, encoding is detected once the first ENCODING_SNIFF_BYTES or the whole head section
+    are received
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= ENCODING_SNIFF_BYTES or _HEAD_END_RE.search(head):
+            break
+    decoder = codecs.getincrementaldecoder(detect_encoding(head, declared_encoding))(errors="replace")
+    yield decoder.decode(head)
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+class ElementSelector:
+    """
+    Simple element selector: tag name, id and class in a form of "tag", "#id", ".class", "tag#id" or "tag.class"
+    """
+
+    def __init__(self, selector: str) -> None:
+        match = _SELECTOR_RE.match(selector.strip())
+        if match is None or not any(match.groups()):
+            raise ValueError("Unsupported selector: {}".format(selector))
+        self.selector = selector
+        tag, self.id, self.css_class = match.groups()
+        self.tag = tag.lower() if tag else None
+
+    def matches(self, tag: str, attrs: Dict[str, str]) -> bool:
+        if self.tag is not None and tag != self.tag:
+            return False
+        if self.id is not None and attrs.get("id") != self.id:
+            return False
+        if self.css_class is not None and self.css_class not in (attrs.get("class") or "").split():
+            return False
+        return True
+
+
+class HtmlScanner(HTMLParser):
+    """
+    Incremental HTML tokenizer extracting title, meta tags and the first element matching each of the selectors
+    without building a document tree. Scanning stops as soon as all requested targets are found, check done flag
+    before feeding more data.
+    """
+
+    def __init__(self, title: bool = False, meta: Sequence[str] = (), selectors: Sequence[str] = ()) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title = None  # type: Optional[str]
+        # Meta content by lowercase name, property or http-equiv attribute
+        self.meta = {}  # type: Dict[str, str]
+        # Text of the first element matching the selector
+        self.elements = {}  # type: Dict[str, str]
+        self.done = False
+        self.__want_title = title
+        self.__want_meta = set(x.lower() for x in meta)
+        self.__selectors = [ElementSelector(x) for x in selectors]
+        self.__in_head = True
+        self.__title_parts = None  # type: Optional[List[str]]
+        # Elements being captured: selector, tag, nesting depth, text parts
+        self.__capturing = []  # type: List[Tuple[ElementSelector, str, List[int], List[str]]]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title" and self.__want_title and self.title is None:
+            self.__title_parts = []
+        elif tag == "meta":
+            self.__handle_meta(attrs)
+        elif tag == "body":
+            self.__in_head = False
+        for capture in self.__capturing:
+            if capture[1] == tag:
+                capture[2][0] += 1
+        for selector in self.__selectors:
+            if selector.selector not in self.elements and selector.matches(tag, attrs):
+                if tag in VOID_ELEMENTS:
+                    self.elements[selector.selector] = ""
+                elif not any(x[0] is selector for x in self.__capturing):
+                    self.__capturing.append((selector, tag, [1], []))
+        self.__check_done()
+
+    def handle_startendtag(self, tag, attrs):
+        # Self closing tags (<meta />) open and close the element at once
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.__title_parts is not None:
+            self.title = "".join(self.__title_parts) or None
+            self.__title_parts = None
+            self.__want_title = False
+        elif tag == "head":
+            self.__in_head = False
+        for capture in list(self.__capturing):
+            if capture[1] == tag:
+                capture[2][0] -= 1
+                if capture[2][0] == 0:
+                    self.elements[capture[0].selector] = "".join(capture[3])
+                    self.__capturing.remove(capture)
+        self.__check_done()
+
+    def handle_data(self, data):
+        if self.__title_parts is not None:
+            self.__title_parts.append(data)
+        for capture in self.__capturing:
+            capture[3].append(data)
+
+    def __handle_meta(self, attrs: Dict[str, str]):
+        key = attrs.get("name") or attrs.get("property") or attrs.get("http-equiv")
+        if key is None:
+            if attrs.get("charset") and "charset" in self.__want_meta:
+                self.meta.setdefault("charset", attrs["charset"])
+            return
+        key = key.lower()
+        if key in self.__want_meta:
+            self.meta.setdefault(key, attrs.get("content") or "")
+
+    def __check_done(self):
+        title_done = not self.__want_title
+        # Meta tags are expected in head section only
+        meta_done = not self.__in_head or self.__want_meta.issubset(self.meta)
+        elements_done = all(x.selector in self.elements for x in self.__selectors)
+        self.done = title_done and meta_done and elements_done
+
+    def feed_chunks(self, chunks: Iterable[bytes], encoding: str = None) -> "HtmlScanner":
+        """
+        Feeds byte chunks until all targets are found. The rest of the chunks is not consumed.
+        """
+        self.__check_done()
+        for text in iter_decoded(chunks, encoding):
+            if self.done:
+                break
+            self.feed(text)
+        if not self.done:
+            self.close()
+        return self
+
+
+def scan_html(
+    chunks: Iterable[bytes],
+    title: bool = False,
+    meta: Sequence[str] = (),
+    selectors: Sequence[str] = (),
+    encoding: str = None,
+) -> HtmlScanner:
+    """
+    Scans HTML given by chunks of bytes, see HtmlScanner
+    """
+    return HtmlScanner(title, meta, selectors).feed_chunks(chunks, encoding)
@@ -0,0 +1,399 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import socket
+import threading
+import time
+from typing import Deque, Dict, Iterator, List, Tuple, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from healthcheckbot.common.dns import DnsCache
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+PoolKey = Tuple[str, str, int]
+IdleSession = Tuple[float, requests.Session]
+
+
+def pool_key(url: str) -> PoolKey:
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    return scheme, (parts.hostname or "").lower(), parts.port or DEFAULT_PORTS.get(scheme, 0)
+
+
+class PhaseTimings:
+    """
+    Time in seconds spent in each phase of HTTP request:
+
+    * dns - host name resolution
+    * connect - TCP connection establishment
+    * tls - TLS handshake
+    * ttfb - time from sending the request till the first byte of response (server think time)
+    * body - response body transfer
+
+    Connection phases are 0 when keep-alive connection was reused.
+    """
+
+    PHASES = ("dns", "connect", "tls", "ttfb", "body")
+
+    def __init__(self) -> None:
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.body = 0.0
+        self.connection_reused = True
+
+    @property
+    def total(self) -> float:
+        return self.dns + self.connect + self.tls + self.ttfb + self.body
+
+    def to_dict(self) -> Dict[str, float]:
+        result = {x: round(getattr(self, x), 6) for x in self.PHASES}
+        result["total"] = round(self.total, 6)
+        result["connection_reused"] = self.connection_reused
+        return result
+
+
+# Timings and DNS cache of the request being sent by the current thread
+_request_context = threading.local()
+
+
+@contextlib.contextmanager
+def use_dns_cache(dns_cache: Optional[DnsCache]):
+    """
+    Host names of connections opened by the current thread within the block are resolved via the given cache
+    """
+    _request_context.dns_cache = dns_cache
+    try:
+        yield
+    finally:
+        _request_context.dns_cache = None
+
+
+def _current_timings() -> Optional[PhaseTimings]:
+    return getattr(_request_context, "timings", None)
+
+
+class TimedConnectionMixin:
+    """
+    Measures DNS resolution and TCP connect time separately. Host name is resolved before connection and resolved
+    addresses are tried one by one.
+    """
+
+    def _new_conn(self):
+        timings = _current_timings()
+        if timings is None:
+            return super()._new_conn()
+        timings.connection_reused = False
+        started = time.perf_counter()
+        addresses = self._resolve()
+        resolved = time.perf_counter()
+        timings.dns = resolved - started
+        original_host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = original_host
+            timings.connect = time.perf_counter() - resolved
+
+    def _resolve(self):
+        dns_cache = getattr(_request_context, "dns_cache", None)  # type: Optional[DnsCache]
+        try:
+            if dns_cache is not None:
+                return dns_cache.resolve(self._dns_host)
+            infos = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, "Failed to establish a new connection: %s" % e)
+        return list(collections.OrderedDict.fromkeys(x[4][0] for x in infos))
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        timings = _current_timings()
+        started = time.perf_counter()
+        super().connect()
+        if timings is not None:
+            timings.tls = max(0.0, time.perf_counter() - started - timings.dns - timings.connect)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedResponse(requests.Response):
+    """
+    Response carrying PhaseTimings and URL requested by the watcher, both are preserved when response is pickled
+    to be passed from process pool.
+    """
+
+    __attrs__ = requests.Response.__attrs__ + ["timings", "requested_url"]
+
+    timings = None  # type: Optional[PhaseTimings]
+    requested_url = None  # type: Optional[str]
+
+
+class TimingHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter recording PhaseTimings of each request. Timings are available as response.timings attribute.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+    def send(self, request, stream=False, **kwargs):
+        timings = PhaseTimings()
+        _request_context.timings = timings
+        started = time.perf_counter()
+        try:
+            response = super().send(request, stream=True, **kwargs)
+        finally:
+            _request_context.timings = None
+        headers_received = time.perf_counter()
+        timings.ttfb = max(0.0, headers_received - started - timings.dns - timings.connect - timings.tls)
+        response.__class__ = TimedResponse
+        response.timings = timings
+        if not stream:
+            # Body is read here to measure transfer time, Session won't read it again
+            response.content
+            timings.body = time.perf_counter() - headers_received
+        return response
+
+
+class StreamingBody:
+    """
+    Lazily downloaded response body limited to max_bytes. Chunks are downloaded on demand and cached, so several
+    consumers could iterate the body independently while network is read only once and only as far as the most
+    demanding consumer needs.
+    """
+
+    def __init__(self, response: requests.Response, max_bytes: int = None, chunk_size: int = 16384) -> None:
+        self.max_bytes = max_bytes
+        self.truncated = False
+        self.size = 0
+        self.__response = response
+        self.__chunks = []  # type: List[bytes]
+        self.__source = response.iter_content(chunk_size)
+        self.__exhausted = False
+        self.__started = time.perf_counter()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.__exhausted
+
+    def __fetch(self) -> bool:
+        if self.__exhausted:
+            return False
+        try:
+            chunk = next(self.__source)
+        except StopIteration:
+            self.__finish()
+            return False
+        if self.max_bytes is not None and self.size + len(chunk) > self.max_bytes:
+            chunk = chunk[: self.max_bytes - self.size]
+            self.truncated = True
+        self.__chunks.append(chunk)
+        self.size += len(chunk)
+        if self.truncated:
+            self.__finish()
+        return True
+
+    def __finish(self):
+        self.__exhausted = True
+        timings = getattr(self.__response, "timings", None)
+        if timings is not None:
+            timings.body = time.perf_counter() - self.__started
+        if self.truncated:
+            # Connection with unread data can't be reused
+            self.__response.close()
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        i = 0
+        while True:
+            if i < len(self.__chunks):
+                yield self.__chunks[i]
+                i += 1
+            elif not self.__fetch():
+                return
+
+    def read(self) -> bytes:
+        """
+        Downloads the rest of the body (up to max_bytes) and returns it
+        """
+        while self.__fetch():
+            pass
+        if len(self.__chunks) > 1:
+            self.__chunks = [b"".join(self.__chunks)]
+        return self.__chunks[0] if self.__chunks else b""
+
+    def close(self):
+        if not self.__exhausted:
+            self.__exhausted = True
+            self.__response.close()
+
+    def __getstate__(self):
+        # Body is downloaded before crossing process boundary, the copy doesn't need the connection
+        self.read()
+        state = self.__dict__.copy()
+        state["_StreamingBody__response"] = None
+        state["_StreamingBody__source"] = None
+        return state
+
+
+class StreamedResponse(TimedResponse):
+    """
+    Response with body represented by StreamingBody. content property is limited by max_bytes of the body.
+    """
+
+    __attrs__ = TimedResponse.__attrs__ + ["body"]
+
+    body = None  # type: StreamingBody
+
+    @property
+    def content(self):
+        return self.body.read()
+
+
+def stream_body(response: requests.Response, max_bytes: int = None) -> StreamedResponse:
+    """
+    Attaches StreamingBody to the response obtained with stream=True
+    """
+    response.__class__ = StreamedResponse
+    response.body = StreamingBody(response, max_bytes)
+    return response
+
+
+def iter_body(response: requests.Response, chunk_size: int = 16384) -> Iterator[bytes]:
+    """
+    Iterates response body by chunks. Streamed body is downloaded only as far as the iteration goes.
+    """
+    body = getattr(response, "body", None)
+    if isinstance(body, StreamingBody):
+        yield from body.iter_chunks()
+    else:
+        content = response.content or b""
+        for i in range(0, len(content), chunk_size):
+            yield content[i : i + chunk_size]
+
+
+def create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = TimingHTTPAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class SessionPool:
+    """
+    Pool of requests.Session objects keyed by scheme, host and port, so watchers probing the same host
+    reuse warm keep-alive connections. Up to max_size idle sessions are retained for each key, sessions
+    which were not used for idle_timeout seconds are closed.
+    """
+
+    def __init__(self, max_size: int = 10, idle_timeout: float = 60) -> None:
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # Idle sessions with the time they were released at
+        self.__idle = collections.defaultdict(collections.deque)  # type: Dict[PoolKey, Deque[IdleSession]]
+        self.__lock = threading.Lock()
+        self.__last_eviction = time.monotonic()
+
+    def create_session(self) -> requests.Session:
+        return create_session()
+
+    def acquire(self, url: str) -> requests.Session:
+        key = pool_key(url)
+        with self.__lock:
+            idle = self.__idle.get(key)
+            # The most recently used session is the most likely to have alive connection
+            if idle:
+                return idle.pop()[1]
+        return self.create_session()
+
+    def release(self, url: str, session: requests.Session):
+        key = pool_key(url)
+        # Session might be acquired by another watcher, cookies set by the server shouldn't leak into its checks
+        session.cookies.clear()
+        with self.__lock:
+            idle = self.__idle[key]
+            if len(idle) < self.max_size:
+                idle.append((time.monotonic(), session))
+                session = None
+        if session is not None:
+            session.close()
+        self.evict_idle()
+
+    def evict_idle(self, force=False):
+        """
+        Closes sessions idle for more than idle_timeout seconds. Runs at most once per second unless forced.
+        """
+        now = time.monotonic()
+        expired = []
+        with self.__lock:
+            if not force and now - self.__last_eviction < 1:
+                return
+            self.__last_eviction = now
+            for key in list(self.__idle.keys()):
+                idle = self.__idle[key]
+                while idle and now - idle[0][0] > self.idle_timeout:
+                    expired.append(idle.popleft()[1])
+                if not idle:
+                    del self.__idle[key]
+        for session in expired:
+            session.close()
+
+    def close(self):
+        with self.__lock:
+            sessions = [x[1] for idle in self.__idle.values() for x in idle]
+            self.__idle.clear()
+        for session in sessions:
+            session.close()
+
+
+def get_session_pool(application) -> SessionPool:
+    """
+    Returns session pool shared by all HTTP watchers of the application.
+
+    :type application: healthcheckbot.common.core.ApplicationManager
+    """
+    settings = application.get_instance_settings()
+    return application.get_shared_resource(
+        "http_session_pool", lambda: SessionPool(settings.http_pool_size, settings.http_pool_idle_timeout)
+    )
@@ -14,12 +14,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections.abc
 import json
 import logging
 
 import typing
 from argparse import ArgumentParser
-from typing import List
+from typing import List, Optional, Tuple
+
+from healthcheckbot.common import validators
+from healthcheckbot.common.rules import CompiledRule, compile_rules
 
 
 class CliExtension(object):
@@ -139,13 +143,21 @@ class Module:
     def validate(self):
         pass
 
+    def __getstate__(self):
+        # Modules executed in process pool are shipped without application which isn't picklable
+        state = self.__dict__.copy()
+        state["_Module__application"] = None
+        return state
+
 
 class LoopModuleMixin:
     """
     Modules inheriting this mixin will be registered in application loop. Thus step method will be invoked
-    regularly as a part of main application routine.
+    regularly (each step_interval seconds) as a part of main application routine.
     """
 
+    step_interval = 0.01
+
     def step(self):
         pass
 
@@ -156,7 +168,23 @@ class ValidationError(typing.NamedTuple):
     critical: bool
 
 
+def flatten_dict(dictionary: typing.Mapping, parent_key="", sep="__") -> typing.Dict:
+    items = []
+    for k, v in dictionary.items():
+        new_key = parent_key + sep + k if parent_key else k
+        if isinstance(v, collections.abc.Mapping):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
 class WatcherResult:
+    """
+    Result of the watcher run. Result is immutable once created, so its representations (dict, flat dict, JSON)
+    are built on first access and shared by all outputs. Outputs must not modify returned objects.
+    """
+
     def __init__(
         self,
         state: dict = None,
@@ -166,14 +194,38 @@ class WatcherResult:
         self.assertions_failed = assertions_failed
         self.state = state or {}
         self.extra = extra or {}
+        self.__dict_repr = None  # type: typing.Optional[typing.Dict]
+        self.__flat_dict_repr = None  # type: typing.Optional[typing.Dict]
+        self.__json_repr = None  # type: typing.Optional[str]
+        self.__json_bytes_repr = None  # type: typing.Optional[bytes]
 
     def to_dict(self) -> typing.Dict:
-        return {
-            "failed_assertions": [x._asdict() for x in self.assertions_failed],
-            "checks_passed": int(self.checks_passed),
-            "state": self.state,
-            "extra": self.extra,
-        }
+        if self.__dict_repr is None:
+            self.__dict_repr = {
+                "failed_assertions": [x._asdict() for x in self.assertions_failed or []],
+                "checks_passed": int(self.checks_passed),
+                "state": self.state,
+                "extra": self.extra,
+            }
+        return self.__dict_repr
+
+    def to_flat_dict(self) -> typing.Dict:
+        """
+        Dictionary representation with nested mappings collapsed into keys joined with "__", e.g. state__status_code
+        """
+        if self.__flat_dict_repr is None:
+            self.__flat_dict_repr = flatten_dict(self.to_dict())
+        return self.__flat_dict_repr
+
+    def to_json(self) -> str:
+        if self.__json_repr is None:
+            self.__json_repr = json.dumps(self.to_dict(), default=str)
+        return self.__json_repr
+
+    def to_json_bytes(self) -> bytes:
+        if self.__json_bytes_repr is None:
+            self.__json_bytes_repr = self.to_json().encode("utf-8")
+        return self.__json_bytes_repr
 
     @property
     def checks_passed(self):
@@ -199,13 +251,68 @@ class ValidationReporter:
         self.extra_data[field] = value
 
 
+class AssertionOutcome(typing.NamedTuple):
+    """
+    Errors and extra data reported by declarative and custom assertions of a single check
+    """
+
+    errors: typing.Tuple[ValidationError, ...]
+    extra: typing.Dict[str, str]
+
+
+class CompositeState:
+    """
+    State of the watcher checking multiple targets at once. Each target is evaluated and reported separately:
+    assertions are executed against the state of the target and result gets "target" extra field. Targets failed
+    to obtain state are reported with "obtain_state" error.
+    """
+
+    def __init__(self) -> None:
+        self.items = []  # type: List[Tuple[str, object, Optional[Exception]]]
+
+    def add(self, target: str, state: object = None, error: Exception = None):
+        self.items.append((target, state, error))
+
+    def __len__(self):
+        return len(self.items)
+
+
 class WatcherModule(Module):
+    """
+    If run_in_process is enabled obtain_state is executed in process pool on the copy of the watcher. In this case
+    trigger is not passed (None) and returned state must be picklable.
+    """
+
+    MODULE_LEVEL_PARAMS = (
+        ParameterDef("execution_timeout", validators=(validators.number,)),
+        ParameterDef("run_in_process", validators=(validators.boolean,)),
+        ParameterDef("assertions", validators=(lambda x: isinstance(x, list),)),
+    )
+
+    run_in_process = False
+
     def __init__(self, application):
         super().__init__(application)
         self.enable_assertions = True
         # Max execution time for obtain state section
         self.execution_timeout = 60
         self.custom_assertions = []  # type: List[WatcherAssert]
+        # Declarative assertions (see healthcheckbot.common.rules) and their compiled form
+        self.assertions = None  # type: Optional[List[dict]]
+        self.assertion_plan = []  # type: List[CompiledRule]
+
+    def compile_assertions(self):
+        """
+        Compiles declarative assertions once, called by bootstrap after validation so invalid definitions are
+        reported at startup regardless of validate implementation.
+        """
+        self.assertion_plan = compile_rules(self.assertions)
+
+    def __getstate__(self):
+        # Compiled closures aren't picklable and aren't needed to obtain state in process pool
+        state = super().__getstate__()
+        state["assertion_plan"] = []
+        return state
 
     def obtain_state(self, trigger) -> object:
         """
@@ -228,11 +335,90 @@ class WatcherModule(Module):
         """
         pass
 
+    def replay_assertions(self, state: object) -> Optional[AssertionOutcome]:
+        """
+        Might return outcome of the previous check if the watcher knows that the state hasn't changed since then
+        (e.g. HTTP 304 Not Modified). In this case declarative and custom assertions are not executed and the outcome
+        is reported instead. do_assertions is executed anyway.
+        """
+        return None
+
+    def remember_assertions(self, state: object, outcome: AssertionOutcome):
+        """
+        Invoked with the outcome of declarative and custom assertions, see replay_assertions
+        """
+        pass
+
+    def release_state(self, state: object):
+        """
+        Invoked once state is no longer needed (after serialization), might be used to free resources held by state
+        e.g. network connections.
+        """
+        pass
+
+
+class AsyncWatcherModule(WatcherModule):
+    """
+    Watcher obtaining its state without blocking event loop. Requires asyncio engine.
+    """
+
+    async def obtain_state(self, trigger) -> object:
+        """
+        :type trigger: healthcheckbot.common.core.TriggerModule
+        :return state object
+        """
+        pass
+
 
 class OutputModule(Module):
+    """
+    Results are passed to output_batch in batches of up to batch_size items. Batch is delivered once it is full or
+    batch_linger seconds passed since the first result was queued. Default implementation calls output for
+    each result, network outputs might override output_batch to send all results at once.
+    Failed batch is retried up to max_retries times with retry_delay seconds pause.
+    """
+
+    MODULE_LEVEL_PARAMS = (
+        ParameterDef("batch_size", validators=(validators.integer,)),
+        ParameterDef("batch_linger", validators=(validators.number,)),
+        ParameterDef("max_retries", validators=(validators.integer,)),
+        ParameterDef("retry_delay", validators=(validators.number,)),
+    )
+
+    batch_size = 1
+    batch_linger = 0
+    max_retries = 0
+    retry_delay = 1
+
+    def validate(self):
+        super().validate()
+        if self.batch_size < 1:
+            raise ValueError("Parameter batch_size must be positive")
+        if self.batch_linger < 0:
+            raise ValueError("Parameter batch_linger must not be negative")
+        if self.max_retries < 0:
+            raise ValueError("Parameter max_retries must not be negative")
+
     def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
         pass
 
+    def output_batch(self, results: List[typing.Tuple[WatcherModule, WatcherResult]]):
+        for watcher_instance, watcher_result in results:
+            self.output(watcher_instance, watcher_result)
+
+
+class AsyncOutputModule(OutputModule):
+    """
+    Output delivering results without blocking event loop. Requires asyncio engine.
+    """
+
+    async def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
+        pass
+
+    async def output_batch(self, results: List[typing.Tuple[WatcherModule, WatcherResult]]):
+        for watcher_instance, watcher_result in results:
+            await self.output(watcher_instance, watcher_result)
+
 
 class TriggerModule(Module):
     def register_watcher(self, watcher: WatcherModule):
@@ -240,6 +426,21 @@ class TriggerModule(Module):
 
 
 class WatcherAssert(Module):
+    """
+    If run_in_process is enabled do_assert is executed in process pool on the copy of the assertion, so CPU heavy
+    checks don't hold GIL of the main process. Only the data returned by get_process_state is shipped to the worker.
+    """
+
+    MODULE_LEVEL_PARAMS = (ParameterDef("run_in_process", validators=(validators.boolean,)),)
+
+    run_in_process = False
+
+    def get_process_state(self, state: object) -> object:
+        """
+        Returns picklable subset of the state needed by do_assert when it is executed in process pool.
+        """
+        return state
+
     def do_assert(self, state: object, reporter: ValidationReporter, assertion_name: str):
         """
         :param assertion_name:
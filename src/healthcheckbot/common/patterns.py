@@ -0,0 +1,98 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import re
+from typing import Iterable, List, Sequence, Set
+
+# Constructs which break once pattern is embedded into combined expression: group number references (backreferences,
+# conditionals), named groups (names might clash) and global inline flags. The construct itself mustn't be escaped.
+_STANDALONE_RE = re.compile(r"(?:^|[^\\])(?:\\\\)*(?:\\[1-9]|\(\?\(|\(\?P[<=]|\(\?[aiLmsux]+\))")
+
+
+class MultiPatternMatcher:
+    """
+    Finds which of the patterns occur in the text scanning it only once. All patterns are combined into a single
+    regular expression, text could be fed by chunks. Matches starting close to the end of a chunk are decided once
+    the next chunk arrives, so matches crossing chunk boundary (including anchors and lookarounds) are found as long
+    as they are not longer than max_match_length. Regex patterns which can't be combined (backreferences by number,
+    named groups, global inline flags) are searched separately.
+    """
+
+    def __init__(
+        self, patterns: Sequence[str], regex: bool = False, ignore_case: bool = False, max_match_length: int = 1024
+    ) -> None:
+        flags = re.IGNORECASE if ignore_case else 0
+        sources = list(patterns) if regex else [re.escape(x) for x in patterns]
+        self.patterns = list(patterns)
+        self.__compiled = [re.compile(x, flags) for x in sources]
+        self.__separate = [i for i, x in enumerate(sources) if regex and _STANDALONE_RE.search(x)]
+        combined = [i for i in range(len(sources)) if i not in self.__separate]
+        # Zero width match lets patterns overlap, the scan advances by one character after each match
+        self.__combined = re.compile(
+            "(?=(?:{}))".format("|".join("(?P<p{}>{})".format(i, sources[i]) for i in combined)), flags
+        )
+        self.__has_combined = bool(combined)
+        # Regex match needs one character after it to evaluate $ or \b
+        self.__overlap = max_match_length if regex else max((len(x) for x in patterns), default=1) - 1
+
+    def scan(self, chunks: Iterable[str]) -> Set[int]:
+        """
+        Returns indexes of the patterns found in the text. Scanning stops once all patterns are found.
+        """
+        found = set()  # type: Set[int]
+        if not self.patterns:
+            return found
+        # Text consists of context already scanned (for lookbehinds), undecided tail of the previous chunk and chunk
+        tail = ""
+        start = 0
+        for chunk in chunks:
+            text = tail + chunk
+            end = max(start, len(text) - self.__overlap)
+            self.__scan_text(text, start, end, found)
+            if len(found) == len(self.patterns):
+                return found
+            keep = max(0, end - self.__overlap)
+            tail = text[keep:]
+            start = end - keep
+        self.__scan_text(tail, start, len(tail), found)
+        return found
+
+    def __scan_text(self, text: str, start: int, end: int, found: Set[int]):
+        # Only matches starting in [start, end) are accepted, text around is the context
+        if start >= end:
+            return
+        for i in self.__separate:
+            if i not in found:
+                match = self.__compiled[i].search(text, start)
+                if match is not None and match.start() < end:
+                    found.add(i)
+        if not self.__has_combined:
+            return
+        for match in self.__combined.finditer(text, start):
+            position = match.start()
+            if position >= end:
+                return
+            found.add(int(match.lastgroup[1:]))
+            # Other patterns starting at the same position are hidden by the first matching alternative
+            for i in self.__pending(found):
+                if self.__compiled[i].match(text, position):
+                    found.add(i)
+            if len(found) == len(self.patterns):
+                return
+
+    def __pending(self, found: Set[int]) -> List[int]:
+        return [i for i in range(len(self.patterns)) if i not in found]
@@ -0,0 +1,238 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import re
+from collections.abc import Mapping
+from typing import Any, Callable, List, NamedTuple, Sequence, Tuple
+
+from healthcheckbot.common.document import get_document
+
+MISSING = object()
+
+_JSON_PATH_STEP_RE = re.compile(r"\.([A-Za-z_][\w-]*)|\[(-?\d+)\]|\[\s*(['\"])(.*?)\3\s*\]")
+
+
+class CompiledRule(NamedTuple):
+    """
+    Declarative assertion compiled into a closure. check(state, reporter) reports failures via reporter.
+    """
+
+    name: str
+    check: Callable[[object, object], None]
+
+
+def compile_json_path(path: str) -> Tuple[Any, ...]:
+    """
+    Compiles JSON path like $.items[0].name or $["key.with.dots"] into the sequence of keys and indexes
+    """
+    path = path.strip()
+    if not path.startswith("$"):
+        raise ValueError("JSON path must start with $: {}".format(path))
+    steps = []
+    position = 1
+    while position < len(path):
+        match = _JSON_PATH_STEP_RE.match(path, position)
+        if match is None:
+            raise ValueError("Invalid JSON path {} at position {}".format(path, position))
+        name, index, _, quoted = match.groups()
+        steps.append(int(index) if index is not None else (name if name is not None else quoted))
+        position = match.end()
+    return tuple(steps)
+
+
+def _walk(value, steps: Sequence[Any], attributes: bool = False):
+    for step in steps:
+        if isinstance(value, tuple) and hasattr(value, "_asdict"):
+            # Named tuples (e.g. query results) are addressed by field names like dictionaries
+            value = value._asdict()
+        if isinstance(value, Mapping):
+            value = value.get(step, MISSING)
+        elif isinstance(step, int) and isinstance(value, (list, tuple)):
+            value = value[step] if -len(value) <= step < len(value) else MISSING
+        elif attributes and isinstance(step, str):
+            value = getattr(value, step, MISSING)
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def _json_source(path: str):
+    steps = compile_json_path(path)
+
+    def get_value(state):
+        # Body of HTTP response or the state itself (e.g. query results)
+        document = get_document(state).json if hasattr(state, "content") else state
+        return _walk(document, steps)
+
+    return get_value
+
+
+def _header_source(name: str):
+    if not isinstance(name, str):
+        raise ValueError("Header name must be a string")
+
+    def get_value(state):
+        return state.headers.get(name, MISSING)
+
+    return get_value
+
+
+def _body_source(_):
+    def get_value(state):
+        return get_document(state).text
+
+    return get_value
+
+
+def _state_source(path: str):
+    if not isinstance(path, str) or not path:
+        raise ValueError("State path must be a non-empty string")
+    steps = tuple(int(x) if x.lstrip("-").isdigit() else x for x in path.split("."))
+
+    def get_value(state):
+        return _walk(state, steps, attributes=True)
+
+    return get_value
+
+
+# Source name -> factory building value getter from the source argument
+SOURCES = {
+    "json_path": _json_source,
+    "header": _header_source,
+    "body": _body_source,
+    "state": _state_source,
+}
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _comparison(compare: Callable[[float, float], bool]):
+    def factory(operand):
+        if _to_number(operand) is None:
+            raise ValueError("Numeric operand expected, got {!r}".format(operand))
+        operand = _to_number(operand)
+
+        def predicate(actual):
+            actual = _to_number(actual)
+            return actual is not None and compare(actual, operand)
+
+        return predicate
+
+    return factory
+
+
+def _regex(negate: bool):
+    def factory(operand):
+        try:
+            pattern = re.compile(operand)
+        except (re.error, TypeError) as e:
+            raise ValueError("Invalid regular expression {!r}: {}".format(operand, e))
+        return lambda actual: (pattern.search(str(actual)) is None) == negate
+
+    return factory
+
+
+def _contains(operand):
+    def predicate(actual):
+        try:
+            return operand in actual
+        except TypeError:
+            return False
+
+    return predicate
+
+
+# Operator name -> (factory building predicate from the operand, description used in error message)
+OPERATORS = {
+    "equals": (lambda operand: lambda actual: actual == operand, "to be equal to"),
+    "not_equals": (lambda operand: lambda actual: actual != operand, "not to be equal to"),
+    "contains": (_contains, "to contain"),
+    "matches": (_regex(False), "to match"),
+    "not_matches": (_regex(True), "not to match"),
+    "lt": (_comparison(lambda a, b: a < b), "to be <"),
+    "lte": (_comparison(lambda a, b: a <= b), "to be <="),
+    "gt": (_comparison(lambda a, b: a > b), "to be >"),
+    "gte": (_comparison(lambda a, b: a >= b), "to be >="),
+}
+
+RULE_OPTIONS = ("name", "critical", "exists")
+
+
+def compile_rule(definition: dict) -> CompiledRule:
+    """
+    Compiles assertion definition, e.g. {"json_path": "$.status", "equals": "ok"}, into CompiledRule.
+    Definition consists of exactly one source (see SOURCES), any number of operators (see OPERATORS) and
+    optional name, critical and exists (true by default) options.
+
+    :raises ValueError: if definition is invalid
+    """
+    if not isinstance(definition, Mapping):
+        raise ValueError("Assertion must be a dictionary")
+    unknown = [x for x in definition if x not in SOURCES and x not in OPERATORS and x not in RULE_OPTIONS]
+    if unknown:
+        raise ValueError("Unknown assertion options: {}".format(", ".join(unknown)))
+    sources = [x for x in SOURCES if x in definition]
+    if len(sources) != 1:
+        raise ValueError("Assertion must have exactly one of: {}".format(", ".join(SOURCES)))
+    source = sources[0]
+    get_value = SOURCES[source](definition[source])
+    label = source if source == "body" else "{} {}".format(source, definition[source])
+    name = definition.get("name") or label
+    critical = bool(definition.get("critical", True))
+    should_exist = bool(definition.get("exists", True))
+    predicates = [
+        (OPERATORS[op][0](operand), "{} {!r}".format(OPERATORS[op][1], operand))
+        for op, operand in definition.items()
+        if op in OPERATORS
+    ]
+
+    def check(state, reporter):
+        try:
+            actual = get_value(state)
+        except Exception as e:
+            reporter.error(name, "Unable to read {}: {}".format(label, e), critical)
+            return
+        if (actual is not MISSING) != should_exist:
+            reporter.error(
+                name, "Expected {} {}".format(label, "to exist" if should_exist else "not to exist"), critical
+            )
+            return
+        for predicate, expectation in predicates:
+            if not predicate(actual):
+                reporter.error(name, "Expected {} {} but actual is {!r}".format(label, expectation, actual), critical)
+                return
+
+    return CompiledRule(name, check)
+
+
+def compile_rules(definitions: Sequence[dict]) -> List[CompiledRule]:
+    result = []
+    for i, definition in enumerate(definitions or ()):
+        try:
+            result.append(compile_rule(definition))
+        except ValueError as e:
+            raise ValueError("Assertion #{}: {}".format(i + 1, e))
+    return result
@@ -0,0 +1,123 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class ScheduledCall:
+    """
+    Handle of the callback registered in Scheduler. Could be used to cancel the call before it is fired.
+    """
+
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline: float, callback: Callable, args: tuple) -> None:
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    Priority queue of callbacks keyed by monotonic deadline.
+
+    Callbacks are executed by the thread calling run_pending (application main loop). Any thread might register
+    new calls, in this case the waiting loop is woken up to recalculate its sleep time.
+    """
+
+    def __init__(self) -> None:
+        self.__heap = []  # type: List[tuple]
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__woken = False
+        self.__waker = None  # type: Optional[Callable[[], None]]
+        self.__logger = logging.getLogger("Scheduler")
+
+    @staticmethod
+    def time() -> float:
+        return time.monotonic()
+
+    def call_at(self, deadline: float, callback: Callable, *args) -> ScheduledCall:
+        call = ScheduledCall(deadline, callback, args)
+        with self.__condition:
+            heapq.heappush(self.__heap, (deadline, next(self.__counter), call))
+        self.wake()
+        return call
+
+    def call_later(self, delay: float, callback: Callable, *args) -> ScheduledCall:
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_soon(self, callback: Callable, *args) -> ScheduledCall:
+        return self.call_at(self.time(), callback, *args)
+
+    def wake(self):
+        with self.__condition:
+            self.__woken = True
+            self.__condition.notify()
+            waker = self.__waker
+        if waker is not None:
+            waker()
+
+    def set_waker(self, waker: Optional[Callable[[], None]]):
+        """
+        Registers additional callback invoked each time the loop needs to be woken up. Used by loops which
+        do not block on wait(), e.g. asyncio engine.
+        """
+        with self.__condition:
+            self.__woken = False
+            self.__waker = waker
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def run_pending(self) -> Optional[float]:
+        """
+        Executes all calls which are due.
+
+        :return: number of seconds till the next deadline or None if there is nothing scheduled
+        """
+        while True:
+            with self.__condition:
+                while self.__heap and self.__heap[0][2].cancelled:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    return None
+                delay = self.__heap[0][0] - self.time()
+                if delay > 0:
+                    return delay
+                call = heapq.heappop(self.__heap)[2]
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                self.__logger.error("Error in during main loop execution: " + str(e))
+
+    def wait(self, timeout: Optional[float]):
+        """
+        Blocks until timeout expires or new call is registered.
+        """
+        with self.__condition:
+            if not self.__woken:
+                self.__condition.wait(timeout)
+            self.__woken = False
@@ -14,7 +14,12 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
 from healthcheckbot.common import validators
+from healthcheckbot.common.dns import get_dns_cache
 from healthcheckbot.common.model import WatcherModule, ParameterDef, ValidationReporter
 import redis
 
@@ -30,33 +35,75 @@ class RedisQueueSizeWatcher(WatcherModule):
         self.assert_min_qty = None
         self.assert_max_qty = None
         self.__redis = None  # type: redis.Redis
+        self.__address = None
+        # Time spent resolving host name via DNS cache by the last run, None if host wasn't resolved by the watcher.
+        # State remains plain messages count for compatibility with custom assertions.
+        self.__dns_time = None  # type: Optional[float]
         self.socket_timeout = 7000
+        # If set host name is resolved via application DNS cache (see dns_cache_ttl)
+        self.use_dns_cache = True
 
-    def obtain_state(self, trigger) -> object:
-        if self.__redis is None:
-            if self.url:
-                self.__redis = redis.Redis.from_url(
-                    url=self.url,
-                    db=self.db,
-                    socket_timeout=self.socket_timeout,
-                    socket_connect_timeout=self.socket_timeout,
-                    max_connections=1,
-                )
-            else:
-                self.__redis = redis.Redis(
-                    host=self.host,
-                    port=self.port,
-                    db=self.db,
-                    socket_timeout=self.socket_timeout,
-                    max_connections=1,
-                    socket_connect_timeout=self.socket_timeout,
-                )
+    def __resolve(self):
+        """
+        :return: address to connect to (None means host from the config) and time spent on resolution
+        """
+        dns_cache = get_dns_cache(self.get_application_manager()) if self.use_dns_cache else None
+        if dns_cache is None:
+            return None, None
+        if self.url:
+            parts = urlsplit(self.url)
+            # Address can't replace host name for TLS connections and unix sockets
+            if parts.scheme != "redis" or not parts.hostname:
+                return None, None
+            host = parts.hostname
+        else:
+            host = self.host
+        started = time.perf_counter()
+        address = dns_cache.resolve(host)[0]
+        return address, time.perf_counter() - started
+
+    def __create_client(self, address: Optional[str]) -> redis.Redis:
+        if self.url:
+            url = self.url
+            if address is not None:
+                parts = urlsplit(url)
+                user_info, _, _ = parts.netloc.rpartition("@")
+                netloc = "[{}]".format(address) if ":" in address else address
+                if parts.port:
+                    netloc += ":{}".format(parts.port)
+                if user_info:
+                    netloc = user_info + "@" + netloc
+                url = parts._replace(netloc=netloc).geturl()
+            return redis.Redis.from_url(
+                url=url,
+                db=self.db,
+                socket_timeout=self.socket_timeout,
+                socket_connect_timeout=self.socket_timeout,
+                max_connections=1,
+            )
+        return redis.Redis(
+            host=address or self.host,
+            port=self.port,
+            db=self.db,
+            socket_timeout=self.socket_timeout,
+            max_connections=1,
+            socket_connect_timeout=self.socket_timeout,
+        )
+
+    def obtain_state(self, trigger) -> int:
+        address, self.__dns_time = self.__resolve()
+        if self.__redis is None or address != self.__address:
+            self.__redis = self.__create_client(address)
+            self.__address = address
         messages_count = self.__redis.llen(self.queue_name)
         self.__redis.connection_pool.disconnect()
         return messages_count
 
     def serialize_state(self, state: int) -> [dict, None]:
-        return {"queue": self.queue_name, "msg_qty": state}
+        result = {"queue": self.queue_name, "msg_qty": state}
+        if self.__dns_time is not None:
+            result["dns_time"] = round(self.__dns_time, 6)
+        return result
 
     def do_assertions(self, state: int, reporter: ValidationReporter):
         if self.assert_min_qty is not None:
@@ -82,4 +129,5 @@ class RedisQueueSizeWatcher(WatcherModule):
         ParameterDef("db", validators=(validators.integer,)),
         ParameterDef("assert_min_qty", validators=(validators.integer,)),
         ParameterDef("assert_max_qty", validators=(validators.integer,)),
+        ParameterDef("use_dns_cache", validators=(validators.boolean,)),
     )
@@ -14,51 +14,514 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import hashlib
+import itertools
 import json
-from datetime import datetime
-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta
 from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from uuid import UUID
+
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
-from healthcheckbot.common.model import WatcherModule, ParameterDef
+from healthcheckbot.common import validators
+from healthcheckbot.common.dns import DnsCache, get_dns_cache
+from healthcheckbot.common.model import WatcherModule, ParameterDef, ValidationReporter
 import psycopg2
+import psycopg2.errors
+
+
+class ManagedConnectionPool(ThreadedConnectionPool):
+    """
+    Thread safe pool of autocommit connections. Connections are opened lazily, borrowed connections idle for more
+    than validate_after seconds are checked with a trivial query and replaced if broken. Failed connection attempts
+    postpone the next one with exponential backoff, so unavailable server isn't flooded with connection attempts.
+    """
+
+    BACKOFF_INITIAL = 1
+    BACKOFF_MAX = 60
+
+    def __init__(
+        self, max_size: int, connection_params: dict, dns_cache: DnsCache = None, validate_after: float = 30
+    ) -> None:
+        super().__init__(0, max_size, **connection_params)
+        # Up to max_size idle connections are retained, minconn of the base pool is used as idle limit
+        self.minconn = max_size
+        self.validate_after = validate_after
+        self.__dns_cache = dns_cache
+        self.__semaphore = threading.BoundedSemaphore(max_size)
+        self.__last_used = {}  # type: Dict[int, float]
+        self.__failures = 0
+        self.__retry_at = 0.0
+        self.__last_error = None  # type: Optional[Exception]
+
+    def _connect(self, key=None):
+        # Invoked under the pool lock, so concurrent borrowers don't open connections at the same time
+        now = time.monotonic()
+        if now < self.__retry_at:
+            raise psycopg2.OperationalError(
+                "Reconnect postponed for {:.1f}s after failure: {}".format(self.__retry_at - now, self.__last_error)
+            )
+        kwargs = self._kwargs
+        host = kwargs.get("host")
+        # Unix socket directories and multiple hosts are passed to libpq as is
+        if self.__dns_cache is not None and host and "hostaddr" not in kwargs:
+            if not host.startswith("/") and "," not in host:
+                # Host name is kept for TLS verification and authentication while libpq connects to hostaddr
+                kwargs = dict(kwargs, hostaddr=self.__dns_cache.resolve(host)[0])
+        try:
+            conn = psycopg2.connect(*self._args, **kwargs)
+        except Exception as e:
+            self.__failures += 1
+            self.__retry_at = now + min(self.BACKOFF_MAX, self.BACKOFF_INITIAL * 2 ** (self.__failures - 1))
+            self.__last_error = e
+            raise
+        self.__failures = 0
+        self.__last_used[id(conn)] = now
+        conn.autocommit = True
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+    def __is_valid(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self.__last_used.get(id(conn), 0) < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def __borrow(self):
+        # Each of the idle connections might be broken, e.g. after server restart
+        for _ in range(self.maxconn):
+            conn = self.getconn()
+            if self.__is_valid(conn):
+                return conn
+            self.__release(conn, close=True)
+        return self.getconn()
+
+    def __release(self, conn, close=False):
+        self.__last_used.pop(id(conn), None)
+        if not close and not conn.closed:
+            self.__last_used[id(conn)] = time.monotonic()
+        self.putconn(conn, close=close)
+
+    @contextlib.contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Borrows connection for the duration of the block. Connection broken within the block is discarded.
+
+        :param timeout: max number of seconds to wait for a free connection
+        """
+        if not self.__semaphore.acquire(timeout=timeout if timeout is not None else -1):
+            raise PoolError("Timed out waiting for a free connection")
+        try:
+            conn = self.__borrow()
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.__release(conn, close=True)
+                raise
+            except Exception:
+                self.__release(conn)
+                raise
+            else:
+                self.__release(conn)
+        finally:
+            self.__semaphore.release()
+
+    def close(self):
+        if not self.closed:
+            self.closeall()
+
+
+def get_connection_pool(application, connection_params: dict, max_size: int, use_dns_cache: bool = True):
+    """
+    Returns connection pool shared by all watchers of the application with the same connection parameters.
+    Size of the pool is defined by the first watcher requested it.
+
+    :type application: healthcheckbot.common.core.ApplicationManager
+    """
+    dns_cache = get_dns_cache(application) if use_dns_cache else None
+    # Key is a digest since resource names might be logged and connection parameters contain password
+    params = json.dumps([connection_params, dns_cache is not None], sort_keys=True, default=str)
+    key = "postgres_pool:" + hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+    def factory():
+        return ManagedConnectionPool(max_size, dict(connection_params, cursor_factory=RealDictCursor), dns_cache)
+
+    if application is None:
+        return factory()
+    return application.get_shared_resource(key, factory)
+
+
+def _bytes_to_hex(value) -> str:
+    return bytes(value).hex()
+
+
+def _list_to_native(value: list) -> list:
+    return [to_native(x) for x in value]
+
+
+# Conversions of values returned by psycopg2 which aren't supported by json module, looked up by exact type
+NATIVE_CONVERTERS = {
+    Decimal: float,
+    datetime: datetime.isoformat,
+    date: date.isoformat,
+    dt_time: dt_time.isoformat,
+    timedelta: timedelta.total_seconds,
+    UUID: str,
+    bytes: _bytes_to_hex,
+    memoryview: _bytes_to_hex,
+    list: _list_to_native,
+}
+
+
+def to_native(value):
+    """
+    Converts value fetched from the database to JSON serializable type
+    """
+    converter = NATIVE_CONVERTERS.get(type(value))
+    return value if converter is None else converter(value)
+
+
+class QueryDef(NamedTuple):
+    sql: str
+    # Max number of rows fetched, the rest of the result set is not transferred
+    max_rows: Optional[int] = None
+    # Server side limit of the query execution time in seconds
+    statement_timeout: Optional[float] = None
+
 
+class QueryResult(NamedTuple):
+    rows: Optional[list]
+    # Execution time in seconds including fetching of the rows
+    duration: float
+    error: Optional[str] = None
+    # True if result set had more than max_rows rows
+    truncated: bool = False
+    # Column names, set in columnar format where rows are tuples
+    columns: Optional[List[str]] = None
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Decimal):
-            return float(o)
-        if isinstance(o, datetime):
-            return o.isoformat()
-        return super(DecimalEncoder, self).default(o)
+
+def parse_query_def(definition: Union[str, dict], max_rows: int = None, statement_timeout: float = None) -> QueryDef:
+    """
+    Parses query given either as SQL string or dictionary with sql, max_rows and statement_timeout keys
+    """
+    if isinstance(definition, str):
+        return QueryDef(definition, max_rows, statement_timeout)
+    if not isinstance(definition, dict) or not isinstance(definition.get("sql"), str):
+        raise ValueError("Query must be SQL string or dictionary with sql key")
+    unknown = set(definition) - set(QueryDef._fields)
+    if unknown:
+        raise ValueError("Unknown query options: {}".format(", ".join(sorted(unknown))))
+    query = QueryDef(
+        definition["sql"],
+        definition.get("max_rows", max_rows),
+        definition.get("statement_timeout", statement_timeout),
+    )
+    if query.max_rows is not None and (not validators.integer(query.max_rows) or query.max_rows < 1):
+        raise ValueError("max_rows must be positive integer")
+    if query.statement_timeout is not None and (
+        not validators.number(query.statement_timeout) or query.statement_timeout <= 0
+    ):
+        raise ValueError("statement_timeout must be positive number")
+    return query
+
+
+_cursor_ids = itertools.count()
+
+RESULT_FORMATS = ("rows", "columnar")
 
 
 class DatabaseQueryWatcher(WatcherModule):
     PARAMS = [
         ParameterDef("db_connection", is_required=True),
         ParameterDef("queries", is_required=True),
+        ParameterDef("use_dns_cache", validators=(validators.boolean,)),
+        ParameterDef("pool_size", validators=(validators.integer,)),
+        ParameterDef("pool_timeout", validators=(validators.number,)),
+        ParameterDef("parallel_queries", validators=(validators.boolean,)),
+        ParameterDef("max_parallel_queries", validators=(validators.integer,)),
+        ParameterDef("max_rows", validators=(validators.integer,)),
+        ParameterDef("statement_timeout", validators=(validators.number,)),
+        ParameterDef("result_format", validators=(validators.string,)),
     ]
 
     def __init__(self, application):
         super().__init__(application)
         self.db_connection = {}
         self.queries = {}
+        # If set host name is resolved via application DNS cache (see dns_cache_ttl)
+        self.use_dns_cache = True
+        # Max number of connections to the database shared by watchers with the same db_connection
+        self.pool_size = 5
+        # Max number of seconds to wait for a free connection
+        self.pool_timeout = 10
+        # If set queries are executed concurrently, each on its own connection
+        self.parallel_queries = False
+        self.max_parallel_queries = 4
+        # Defaults for queries which don't set their own limits
+        self.max_rows = None
+        self.statement_timeout = None
+        # "rows" - list of dictionaries, "columnar" - column names and list of row tuples
+        self.result_format = "rows"
+        self.__query_defs = {}  # type: Dict[str, QueryDef]
+        self.__pool = None  # type: Optional[ManagedConnectionPool]
+        self.__executor = None  # type: Optional[ThreadPoolExecutor]
+
+    def serialize_state(self, state: Dict[str, QueryResult]) -> [dict, None]:
+        result = {}
+        for name, query_result in state.items():
+            serialized = {
+                "rows": query_result.rows,
+                "duration": round(query_result.duration, 6),
+                "error": query_result.error,
+                "truncated": query_result.truncated,
+            }
+            if query_result.columns is not None:
+                serialized["columns"] = query_result.columns
+            result[name] = serialized
+        return result
 
-    def serialize_state(self, state: object) -> [dict, None]:
-        return json.dumps(state, cls=DecimalEncoder)
+    def do_assertions(self, state: Dict[str, QueryResult], reporter: ValidationReporter):
+        for name, result in state.items():
+            if result.error is not None:
+                reporter.error("{}_query".format(name), "Query failed: {}".format(result.error))
+
+    def get_connection_params(self) -> dict:
+        return {k: self.db_connection[k] for k in self.db_connection.keys()}
+
+    def validate(self):
+        super().validate()
+        if self.pool_size < 1:
+            raise ValueError("Parameter pool_size must be positive")
+        if self.run_in_process:
+            raise ValueError("run_in_process is not supported by DatabaseQueryWatcher")
+        if self.parallel_queries and not 0 < self.max_parallel_queries <= self.pool_size:
+            raise ValueError("Parameter max_parallel_queries must be positive and not greater than pool_size")
+        if self.result_format not in RESULT_FORMATS:
+            raise ValueError("Parameter result_format must be one of: " + ", ".join(RESULT_FORMATS))
+        if not isinstance(self.queries, dict):
+            raise ValueError("Parameter queries must be a dictionary")
+        query_defs = {}
+        for name, definition in self.queries.items():
+            try:
+                query_defs[name] = parse_query_def(definition, self.max_rows, self.statement_timeout)
+            except ValueError as e:
+                raise ValueError("Query {}: {}".format(name, e))
+        self.__query_defs = query_defs
 
     def on_configured(self):
-        connection_params = {k: self.db_connection[k] for k in self.db_connection.keys()}
-        self.conn = psycopg2.connect(**connection_params, cursor_factory=RealDictCursor)
+        self.__pool = get_connection_pool(
+            self.get_application_manager(), self.get_connection_params(), self.pool_size, self.use_dns_cache
+        )
+        if self.parallel_queries:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=min(self.max_parallel_queries, len(self.queries)) or 1, thread_name_prefix=self.name
+            )
+
+    def on_before_destroyed(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+
+    def obtain_state(self, trigger) -> Dict[str, QueryResult]:
+        if self.__executor is not None:
+            futures = {
+                name: self.__executor.submit(self.__execute_on_pool, query) for name, query in self.__query_defs.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+        with self.__pool.connection(self.pool_timeout) as conn:
+            return {name: self.execute_query(conn, query) for name, query in self.__query_defs.items()}
 
-    def obtain_state(self, trigger) -> object:
-        cur = self.conn.cursor()
+    def __execute_on_pool(self, query: QueryDef) -> QueryResult:
+        with self.__pool.connection(self.pool_timeout) as conn:
+            return self.execute_query(conn, query)
+
+    def execute_query(self, conn, query: QueryDef) -> QueryResult:
+        """
+        Executes the query, failure of the query is reported in the result unless connection is lost
+        """
+        started = time.perf_counter()
+        try:
+            if query.max_rows is None and query.statement_timeout is None:
+                columns, rows = self.__fetch(conn.cursor(cursor_factory=extensions.cursor), query.sql)
+            else:
+                columns, rows = self.__execute_bounded(conn, query)
+        except psycopg2.Error as e:
+            if conn.closed:
+                raise
+            return QueryResult(None, time.perf_counter() - started, str(e).strip())
+        truncated = query.max_rows is not None and len(rows) > query.max_rows
+        if truncated:
+            rows = rows[: query.max_rows]
+        # Values are made JSON friendly once here, so the state is serialized without custom encoder
+        if self.result_format == "columnar":
+            rows = [tuple([to_native(x) for x in row]) for row in rows]
+            return QueryResult(rows, time.perf_counter() - started, truncated=truncated, columns=columns)
+        rows = [{name: to_native(x) for name, x in zip(columns, row)} for row in rows]
+        return QueryResult(rows, time.perf_counter() - started, truncated=truncated)
+
+    @staticmethod
+    def __fetch(cursor, sql: str, max_rows: int = None) -> Tuple[List[str], list]:
+        with cursor as cur:
+            cur.execute(sql)
+            # One extra row tells if the result was truncated
+            rows = cur.fetchall() if max_rows is None else cur.fetchmany(max_rows + 1)
+            return [x[0] for x in cur.description], rows
+
+    def __execute_bounded(self, conn, query: QueryDef) -> Tuple[List[str], list]:
+        # SET LOCAL and server side cursors require transaction, it is committed as soon as rows are fetched
+        conn.autocommit = False
         try:
-            result = {}
-            for name, query in self.queries.items():
-                result[name] = []
-                cur.execute(query)
-                result[name] = [dict(x) for x in cur.fetchall()]
+            if query.statement_timeout is not None:
+                with conn.cursor() as cur:
+                    cur.execute("SET LOCAL statement_timeout = %s", (int(query.statement_timeout * 1000),))
+            if query.max_rows is None:
+                cursor = conn.cursor(cursor_factory=extensions.cursor)
+            else:
+                # Named cursor transfers only requested rows
+                cursor = conn.cursor(
+                    name="healthcheckbot_{}".format(next(_cursor_ids)), cursor_factory=extensions.cursor
+                )
+            result = self.__fetch(cursor, query.sql, query.max_rows)
+            conn.commit()
             return result
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
         finally:
-            cur.close()
+            if not conn.closed:
+                conn.autocommit = True
+
+
+# Collects all metrics in a single row, requires PostgreSQL 10+ and pg_monitor role to see sessions of other users
+HEALTH_QUERY = """
+SELECT
+    pg_is_in_recovery() AS is_replica,
+    a.connections,
+    current_setting('max_connections')::int AS max_connections,
+    a.active_connections,
+    a.idle_in_transaction,
+    a.longest_transaction,
+    (SELECT count(*) FROM pg_locks WHERE NOT granted) AS waiting_locks,
+    pg_database_size(current_database()) AS database_size,
+    CASE WHEN pg_is_in_recovery()
+        THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp())::float8
+    END AS replication_lag,
+    CASE WHEN NOT pg_is_in_recovery()
+        THEN (SELECT max(pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn))::bigint FROM pg_stat_replication)
+    END AS replication_lag_bytes
+FROM (
+    SELECT
+        count(*) AS connections,
+        count(*) FILTER (WHERE state = 'active') AS active_connections,
+        count(*) FILTER (WHERE state LIKE 'idle in transaction%') AS idle_in_transaction,
+        coalesce(extract(epoch FROM max(now() - xact_start)), 0)::float8 AS longest_transaction
+    FROM pg_stat_activity
+    WHERE backend_type = 'client backend' AND pid <> pg_backend_pid()
+) a
+"""
+
+
+class PostgresHealthWatcher(WatcherModule):
+    """
+    Collects server health metrics with a single prepared statement and checks them against configured thresholds
+    """
+
+    STATEMENT_NAME = "healthcheckbot_health"
+
+    # Assertion parameter, metric, assertion name
+    THRESHOLDS = (
+        ("assert_max_connection_usage", "connection_usage", "connection_usage_assert"),
+        ("assert_max_idle_in_transaction", "idle_in_transaction", "idle_in_transaction_assert"),
+        ("assert_max_transaction_duration", "longest_transaction", "transaction_duration_assert"),
+        ("assert_max_waiting_locks", "waiting_locks", "waiting_locks_assert"),
+        ("assert_max_database_size", "database_size", "database_size_assert"),
+        ("assert_max_replication_lag", "replication_lag", "replication_lag_assert"),
+        ("assert_max_replication_lag_bytes", "replication_lag_bytes", "replication_lag_bytes_assert"),
+    )
+
+    PARAMS = [
+        ParameterDef("db_connection", is_required=True),
+        ParameterDef("use_dns_cache", validators=(validators.boolean,)),
+        ParameterDef("pool_size", validators=(validators.integer,)),
+        ParameterDef("pool_timeout", validators=(validators.number,)),
+    ] + [ParameterDef(param, validators=(validators.number,)) for param, _, _ in THRESHOLDS]
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.db_connection = {}
+        self.use_dns_cache = True
+        self.pool_size = 5
+        self.pool_timeout = 10
+        # Share of max_connections, e.g. 0.8
+        self.assert_max_connection_usage = None
+        self.assert_max_idle_in_transaction = None
+        # Seconds
+        self.assert_max_transaction_duration = None
+        self.assert_max_waiting_locks = None
+        # Bytes
+        self.assert_max_database_size = None
+        # Seconds since the last replayed transaction, checked on replicas only
+        self.assert_max_replication_lag = None
+        # Replay lag of the most lagging standby, checked on primary only
+        self.assert_max_replication_lag_bytes = None
+        self.__pool = None  # type: Optional[ManagedConnectionPool]
+
+    def validate(self):
+        super().validate()
+        if self.pool_size < 1:
+            raise ValueError("Parameter pool_size must be positive")
+        if self.run_in_process:
+            raise ValueError("run_in_process is not supported by PostgresHealthWatcher")
+
+    def on_configured(self):
+        self.__pool = get_connection_pool(
+            self.get_application_manager(), dict(self.db_connection), self.pool_size, self.use_dns_cache
+        )
+
+    def obtain_state(self, trigger) -> dict:
+        with self.__pool.connection(self.pool_timeout) as conn:
+            metrics = self.fetch_metrics(conn)
+        metrics["connection_usage"] = round(metrics["connections"] / metrics["max_connections"], 4)
+        return metrics
+
+    def fetch_metrics(self, conn) -> dict:
+        """
+        Executes prepared health statement, the statement is prepared once per connection
+        """
+        with conn.cursor() as cur:
+            try:
+                cur.execute("EXECUTE " + self.STATEMENT_NAME)
+            except psycopg2.errors.InvalidSqlStatementName:
+                # Autocommit connection, failed statement doesn't abort anything
+                cur.execute("PREPARE {} AS {}".format(self.STATEMENT_NAME, HEALTH_QUERY))
+                cur.execute("EXECUTE " + self.STATEMENT_NAME)
+            return dict(cur.fetchone())
+
+    def serialize_state(self, state: dict) -> [dict, None]:
+        return dict(state)
+
+    def do_assertions(self, state: dict, reporter: ValidationReporter):
+        for param, metric, assertion_name in self.THRESHOLDS:
+            limit = getattr(self, param)
+            value = state.get(metric)
+            if limit is not None and value is not None and value > limit:
+                reporter.error(
+                    assertion_name, "Expected maximum {} is {} but actual value is {}".format(metric, limit, value)
+                )
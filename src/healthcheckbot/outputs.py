@@ -16,7 +16,7 @@
 
 import logging
 
-import collections
+from typing import List, Tuple
 from graypy import GELFHandler, GELFTcpHandler
 
 from healthcheckbot.common import validators
@@ -26,12 +26,16 @@ from healthcheckbot.common.model import (
     WatcherModule,
     WatcherResult,
     ParameterDef,
+    flatten_dict,
 )
 
 
 class ConsoleOutput(OutputModule):
     def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
-        print(watcher_result.to_dict())
+        print(watcher_result.to_json())
+
+    def output_batch(self, results: List[Tuple[WatcherModule, WatcherResult]]):
+        print("\n".join(watcher_result.to_json() for _, watcher_result in results))
 
 
 class LoggerOutput(OutputModule):
@@ -44,7 +48,7 @@ class LoggerOutput(OutputModule):
         self.target_logger = None  # type: logging.Logger
 
     def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
-        self.target_logger.log(self.log_level, str(watcher_result.to_dict()))
+        self.target_logger.log(self.log_level, watcher_result.to_json())
 
     def on_configured(self):
         self.target_logger = logging.getLogger(self.logger_name)
@@ -77,15 +81,12 @@ class GelfOutput(OutputModule):
         self.include_instance_name = True
         self.extra_fields = {}
 
-    def __flatten(self, dictionary, parent_key="", sep="__"):
-        items = []
-        for k, v in dictionary.items():
-            new_key = parent_key + sep + k if parent_key else k
-            if isinstance(v, collections.MutableMapping):
-                items.extend(self.__flatten(v, new_key, sep=sep).items())
-            else:
-                items.append((new_key, v))
-        return dict(items)
+    def __include_field(self, key: str) -> bool:
+        if not self.include_state and (key == "state" or key.startswith("state__")):
+            return False
+        if not self.include_validations and key == "failed_assertions":
+            return False
+        return True
 
     def on_configured(self):
         self.gelf_logger = logging.getLogger("GELF")
@@ -119,17 +120,13 @@ class GelfOutput(OutputModule):
             )
 
     def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
-        data = watcher_result.to_dict()
-        if not self.include_state:
-            del data["state"]
-        if not self.include_validations:
-            del data["failed_assertions"]
-        data = self.__flatten(watcher_result.to_dict())
+        # Flat representation is shared with other outputs, so it is copied rather than modified
+        data = {k: v for k, v in watcher_result.to_flat_dict().items() if self.__include_field(k)}
         data.update(dict(tags="healthcheck", watcher_name=watcher_instance.name))
         if self.include_instance_name:
             data["instance"] = self.get_application_manager().get_instance_settings().id
         if len(watcher_result.extra.keys()) > 0 and "extra" in data:
-            data.update(self.__flatten(watcher_result.extra))
+            data.update(flatten_dict(watcher_result.extra))
             del data["extra"]
         data.update(self.extra_fields)
         self.gelf_logger.info(
@@ -14,78 +14,152 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import List
+import random
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
 import datetime
 
 from healthcheckbot.common import validators
+from healthcheckbot.common.core import WatcherRun
 from healthcheckbot.common.model import (
     TriggerModule,
     WatcherModule,
-    LoopModuleMixin,
     ParameterDef,
     WatcherResult,
     ValidationError,
 )
-from healthcheckbot.common.utils import time_limit
 
 
 class SimpleTimerJob:
-    def __init__(self, next_run: datetime.datetime = None, watcher: WatcherModule = None) -> None:
+    def __init__(self, next_run: float = None, watcher: WatcherModule = None) -> None:
+        # Monotonic time of the next run, see Scheduler.time()
         self.next_run = next_run
         self.postpone_interval = None  # type: datetime.timedelta
         self.watcher = watcher
         self.fail_counter = 0
+        # Run currently in progress, None when job is idle. Timed out run stays here until its threads are done
+        self.run = None  # type: Optional[WatcherRun]
 
+    @property
+    def is_running(self):
+        return self.run is not None
+
+
+class SimpleTimer(TriggerModule):
+    """
+    Runs registered watchers with constant interval. Each job registers its next deadline in application scheduler,
+    all job state changes happen in the main loop thread.
+
+    With spread enabled the first run of each watcher is shifted by deterministic offset within the interval
+    derived from the watcher name, so watchers don't fire in the same moment. Jitter adds random delay up to
+    the given number of seconds to each run.
+    """
 
-class SimpleTimer(TriggerModule, LoopModuleMixin):
     def __init__(self, application):
         super().__init__(application)
         self.interval = 300
         self.start_immediately = True
+        self.spread = False
+        self.jitter = 0
+        # If set trigger will use its own worker pool instead of the shared one
+        self.max_workers = None  # type: Optional[int]
+        self.__executor = None  # type: Optional[ThreadPoolExecutor]
         self.__jobs = []  # type: List[SimpleTimerJob]
         self.__max_postpone_duration = datetime.timedelta(minutes=20)
         self.__postpone_interval = None
 
     def on_configured(self):
-        pass
+        if self.max_workers is not None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+
+    def on_before_destroyed(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
 
     def register_watcher(self, watcher: WatcherModule):
-        self.__jobs.append(
-            SimpleTimerJob(
-                next_run=datetime.datetime.now()
-                + datetime.timedelta(seconds=0 if self.start_immediately else self.interval),
-                watcher=watcher,
+        scheduler = self.get_application_manager().get_scheduler()
+        delay = 0 if self.start_immediately else self.interval
+        if self.spread:
+            delay += self.get_spread_offset(watcher)
+        job = SimpleTimerJob(next_run=scheduler.time() + delay + self.__get_jitter(), watcher=watcher)
+        self.__jobs.append(job)
+        self.__schedule_job(job)
+
+    def get_spread_offset(self, watcher: WatcherModule) -> float:
+        """
+        Returns offset within interval which is stable across restarts for the given watcher
+        """
+        key = "{}/{}".format(self.name, watcher.name).encode("utf-8")
+        return (zlib.crc32(key) % 1000) / 1000 * self.interval
+
+    def __get_jitter(self) -> float:
+        return random.uniform(0, self.jitter) if self.jitter else 0
+
+    def __schedule_job(self, job: SimpleTimerJob):
+        self.get_application_manager().get_scheduler().call_at(job.next_run, self.__run_job, job)
+
+    def __run_job(self, job: SimpleTimerJob):
+        if job.is_running:
+            return
+        application = self.get_application_manager()
+        self.logger.info("Running watcher {}".format(job.watcher.name))
+        # Application enforces watcher execution timeout, the future fails with ExecutionTimeoutError on expiration
+        job.run = application.start_watcher_run(job.watcher, self, self.__executor)
+        job.run.future.add_done_callback(lambda f: application.get_scheduler().call_soon(self.__on_job_finished, job))
+
+    def __on_job_finished(self, job: SimpleTimerJob):
+        run = job.run
+        error = run.future.exception()
+        if error is None:
+            job.next_run = self.get_application_manager().get_scheduler().time() + self.interval + self.__get_jitter()
+            job.postpone_interval = None
+            job.fail_counter = 0
+        else:
+            self.__on_job_failed(job, error)
+        if not run.completed.done():
+            self.logger.warning(
+                "Watcher {} is still running, the next cycle will start once it is finished".format(job.watcher.name)
             )
+        scheduler = self.get_application_manager().get_scheduler()
+        run.completed.add_done_callback(lambda f: scheduler.call_soon(self.__complete_job, job))
+
+    def __complete_job(self, job: SimpleTimerJob):
+        # Next run isn't scheduled until abandoned run is done, so the same watcher never runs twice at once
+        job.run = None
+        self.__schedule_job(job)
+
+    def __on_job_failed(self, job: SimpleTimerJob, e: BaseException):
+        self.logger.error("Worker execution failed: " + str(e))
+        if job.postpone_interval is None:
+            job.postpone_interval = datetime.timedelta(seconds=self.interval)
+        job.postpone_interval *= 2
+        job.fail_counter += 1
+        if job.postpone_interval > self.__max_postpone_duration:
+            job.postpone_interval = self.__max_postpone_duration
+        job.next_run = self.get_application_manager().get_scheduler().time() + job.postpone_interval.total_seconds()
+        self.logger.error(
+            "The next cycle will be postponed for {} seconds".format(job.postpone_interval.total_seconds())
         )
+        watcher_result = WatcherResult({}, [ValidationError("execution_cycle", str(e), True)])
+        # Delivery might block on full output queue, so it is done in worker pool rather than in the main loop
+        executor = self.__executor or self.get_application_manager().get_executor()
+        try:
+            executor.submit(self.__deliver_failure, job.watcher, watcher_result)
+        except RuntimeError as delivery_error:
+            self.logger.error("Unable to deliver failed execution result: " + str(delivery_error))
 
-    def step(self):
-        current_time = datetime.datetime.now()
-        for job in self.__jobs:
-            if job.next_run <= current_time:
-                self.logger.info("Running watcher {}".format(job.watcher.name))
-                try:
-                    with time_limit(job.watcher.execution_timeout, msg="Execution watcher timeout"):
-                        self.get_application_manager().run_watcher(job.watcher, self)
-                    job.next_run = datetime.datetime.now() + datetime.timedelta(seconds=self.interval)
-                    job.postpone_interval = None
-                    job.fail_counter = 0
-                except Exception as e:
-                    self.logger.error("Worker execution failed: " + str(e))
-                    if job.postpone_interval is None:
-                        job.postpone_interval = datetime.timedelta(seconds=self.interval)
-                    job.postpone_interval *= 2
-                    job.fail_counter += 1
-                    if job.postpone_interval > self.__max_postpone_duration:
-                        job.postpone_interval = self.__max_postpone_duration
-                    job.next_run = datetime.datetime.now() + job.postpone_interval
-                    self.logger.error(
-                        "The next cycle will be postponed for {} seconds".format(job.postpone_interval.total_seconds())
-                    )
-                    watcher_result = WatcherResult({}, [ValidationError("execution_cycle", str(e), True)])
-                    self.get_application_manager().deliver_watcher_result(job.watcher, watcher_result)
+    def __deliver_failure(self, watcher: WatcherModule, watcher_result: WatcherResult):
+        try:
+            self.get_application_manager().deliver_watcher_result(watcher, watcher_result)
+        except Exception as e:
+            self.logger.error("Unable to deliver failed execution result: " + str(e))
 
     PARAMS = (
         ParameterDef("interval", validators=(validators.integer,)),
         ParameterDef("start_immediately", validators=(validators.boolean,)),
+        ParameterDef("spread", validators=(validators.boolean,)),
+        ParameterDef("jitter", validators=(validators.number,)),
+        ParameterDef("max_workers", validators=(validators.integer,)),
     )
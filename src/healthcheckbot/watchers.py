@@ -14,12 +14,33 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
 
 import requests
 
 from healthcheckbot.common import validators
-from healthcheckbot.common.model import WatcherModule, ParameterDef, ValidationReporter
+from healthcheckbot.common.dns import get_dns_cache
+from healthcheckbot.common.http import (
+    get_session_pool,
+    create_session,
+    pool_key,
+    stream_body,
+    use_dns_cache,
+    PhaseTimings,
+    PoolKey,
+)
+from healthcheckbot.common.model import (
+    AssertionOutcome,
+    CompositeState,
+    ParameterDef,
+    ValidationReporter,
+    WatcherModule,
+)
 
 
 class SystemTimeWatcher(WatcherModule):
@@ -42,6 +63,18 @@ class SystemTimeWatcher(WatcherModule):
     PARAMS = (ParameterDef("error_when_midnight", validators=(validators.boolean,)),)
 
 
+class ConditionalEntry(NamedTuple):
+    """
+    Validators and assertions outcome of the last full response, used for conditional requests
+    """
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: Optional[str]
+    status_code: int
+    outcome: AssertionOutcome
+
+
 class HttpRequest(WatcherModule):
     def __init__(self, application):
         super().__init__(application)
@@ -54,34 +87,153 @@ class HttpRequest(WatcherModule):
         self.timeout = 4
         self.assert_status = None
         self.assert_response_time = None
+        self.assert_ttfb = None
+        # Max duration of the request phases, see PhaseTimings for the list of phases
+        self.assert_phase_times = None
+        # If set new connection is opened for each request instead of reusing pooled one
+        self.fresh_connection = False
+        # If set body is downloaded lazily, only as far as assertions read it
+        self.stream_body = False
+        # Max number of body bytes to download, the rest of the body is discarded
+        self.max_body_bytes = None
+        # If set host name is resolved via application DNS cache (see dns_cache_ttl)
+        self.use_dns_cache = True
+        # If set ETag and Last-Modified of the last response are sent as conditional headers and outcome of
+        # the assertions is reused when content is not modified
+        self.conditional_requests = False
+        self.__conditional_entries = {}  # type: Dict[str, ConditionalEntry]
 
     def obtain_state(self, trigger):
-        return requests.request(
+        return self.request(self.url)
+
+    def request(self, url: str) -> requests.Response:
+        application = self.get_application_manager()
+        with use_dns_cache(get_dns_cache(application) if self.use_dns_cache else None):
+            if self.fresh_connection or application is None:
+                with create_session() as session:
+                    return self.send_request(session, url)
+            pool = get_session_pool(application)
+            session = pool.acquire(url)
+            try:
+                return self.send_request(session, url)
+            finally:
+                pool.release(url, session)
+
+    def send_request(self, session: requests.Session, url: str) -> requests.Response:
+        streamed = self.stream_body or self.max_body_bytes is not None
+        response = session.request(
             self.method,
-            self.url,
+            url,
             data=self.payload,
-            headers=self.headers,
+            headers=self.get_request_headers(url),
             auth=self.basic_auth,
             timeout=self.timeout,
+            stream=streamed,
         )
+        response.requested_url = url
+        if streamed:
+            stream_body(response, self.max_body_bytes)
+            if not self.stream_body:
+                response.body.read()
+        return response
+
+    def get_request_headers(self, url: str) -> Optional[dict]:
+        entry = self.__conditional_entries.get(url) if self.conditional_requests else None
+        if entry is None:
+            return self.headers
+        headers = dict(self.headers or {})
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def get_conditional_entry(self, state: requests.Response) -> Optional[ConditionalEntry]:
+        return self.__conditional_entries.get(getattr(state, "requested_url", state.url))
+
+    @staticmethod
+    def get_body_digest(state: requests.Response) -> Optional[str]:
+        """
+        Returns digest of the complete body, None if body was truncated or not downloaded completely
+        """
+        body = getattr(state, "body", None)
+        if body is not None and (body.truncated or not body.exhausted):
+            return None
+        digest = getattr(state, "body_digest", None)
+        if digest is None:
+            digest = state.body_digest = hashlib.sha256(state.content or b"").hexdigest()
+        return digest
+
+    def replay_assertions(self, state: requests.Response) -> Optional[AssertionOutcome]:
+        if not self.conditional_requests:
+            return None
+        entry = self.get_conditional_entry(state)
+        if entry is None:
+            return None
+        if state.status_code == 304:
+            return entry.outcome
+        # Content without validators is considered unchanged if its digest is the same
+        if state.status_code == entry.status_code and entry.digest is not None:
+            if self.get_body_digest(state) == entry.digest:
+                return entry.outcome
+        return None
+
+    def remember_assertions(self, state: requests.Response, outcome: AssertionOutcome):
+        if not self.conditional_requests or state.status_code == 304:
+            return
+        url = getattr(state, "requested_url", state.url)
+        if not 200 <= state.status_code < 300:
+            self.__conditional_entries.pop(url, None)
+            return
+        self.__conditional_entries[url] = ConditionalEntry(
+            state.headers.get("ETag"),
+            state.headers.get("Last-Modified"),
+            self.get_body_digest(state),
+            state.status_code,
+            outcome,
+        )
+
+    def get_status_code(self, state: requests.Response) -> int:
+        """
+        Returns status of the response, for 304 Not Modified status of the cached response is returned
+        """
+        if state.status_code == 304 and self.conditional_requests:
+            entry = self.get_conditional_entry(state)
+            if entry is not None:
+                return entry.status_code
+        return state.status_code
+
+    def release_state(self, state: requests.Response):
+        state.close()
 
     @property
     def basic_auth(self):
         return None if self.auth_user is None and self.auth_password is None else (self.auth_user, self.auth_password)
 
     def serialize_state(self, state: requests.Response):
-        return dict(
+        result = dict(
             status_code=state.status_code,
             response_time=state.elapsed.total_seconds(),
             url=state.url,
             redirect_history=[dict(status_code=x.status_code, url=x.url) for x in state.history],
         )
+        timings = getattr(state, "timings", None)  # type: PhaseTimings
+        if timings is not None:
+            result["timings"] = timings.to_dict()
+        body = getattr(state, "body", None)
+        if body is not None:
+            result["body_bytes_read"] = body.size
+            result["body_truncated"] = body.truncated
+        if self.conditional_requests:
+            result["not_modified"] = state.status_code == 304
+        return result
 
     def do_assertions(self, state: requests.Response, reporter: ValidationReporter):
-        if self.assert_status is not None and state.status_code != self.assert_status:
+        status_code = self.get_status_code(state)
+        if self.assert_status is not None and status_code != self.assert_status:
             reporter.error(
                 "status_code",
-                "Expected HTTP status {} but got {}".format(self.assert_status, state.status_code),
+                "Expected HTTP status {} but got {}".format(self.assert_status, status_code),
             )
         if self.assert_response_time is not None and state.elapsed.total_seconds() > self.assert_response_time:
             reporter.error(
@@ -89,6 +241,18 @@ class HttpRequest(WatcherModule):
                 "Expected HTTP response time must be "
                 "< {} but actual is {}".format(self.assert_response_time, state.elapsed.total_seconds()),
             )
+        timings = getattr(state, "timings", None)  # type: PhaseTimings
+        if timings is not None:
+            limits = dict(self.assert_phase_times or {})
+            if self.assert_ttfb is not None:
+                limits["ttfb"] = self.assert_ttfb
+            for phase, limit in limits.items():
+                actual = getattr(timings, phase)
+                if actual > limit:
+                    reporter.error(
+                        "{}_time".format(phase),
+                        "Expected {} time must be < {} but actual is {:.6f}".format(phase, limit, actual),
+                    )
 
     PARAMS = (
         ParameterDef("url", is_required=True, validators=(validators.string,)),
@@ -100,4 +264,101 @@ class HttpRequest(WatcherModule):
         ParameterDef("payload"),
         ParameterDef("assert_status"),
         ParameterDef("assert_response_time", validators=(validators.number,)),
+        ParameterDef("assert_ttfb", validators=(validators.number,)),
+        ParameterDef(
+            "assert_phase_times",
+            validators=(
+                validators.dictionary,
+                lambda x: all(k in PhaseTimings.PHASES + ("total",) and validators.number(v) for k, v in x.items()),
+            ),
+        ),
+        ParameterDef("fresh_connection", validators=(validators.boolean,)),
+        ParameterDef("stream_body", validators=(validators.boolean,)),
+        ParameterDef("max_body_bytes", validators=(validators.integer,)),
+        ParameterDef("use_dns_cache", validators=(validators.boolean,)),
+        ParameterDef("conditional_requests", validators=(validators.boolean,)),
+    )
+
+
+class HttpBatchWatcher(HttpRequest):
+    """
+    Probes a list of URLs concurrently within a single run. Each URL is reported as a separate result with "target"
+    extra field, assertions are applied to each URL individually. All request options of HttpRequest are supported.
+    """
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.urls = None  # type: Optional[List[str]]
+        # Text file with one URL per line, empty lines and lines starting with # are ignored
+        self.url_file = None
+        # Max number of requests in flight
+        self.max_concurrency = 20
+        # Max number of requests in flight to the same host
+        self.max_per_host = 4
+        self.__executor = None  # type: Optional[ThreadPoolExecutor]
+
+    def validate(self):
+        super().validate()
+        if not self.urls and not self.url_file:
+            raise ValueError("Either urls or url_file must be set")
+        if self.url_file and not os.path.isfile(self.url_file):
+            raise ValueError("URL file {} doesn't exist".format(self.url_file))
+        if self.max_concurrency < 1 or self.max_per_host < 1:
+            raise ValueError("Parameters max_concurrency and max_per_host must be positive")
+        if self.run_in_process:
+            raise ValueError("run_in_process is not supported by HttpBatchWatcher")
+
+    def on_configured(self):
+        self.__executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=self.name)
+
+    def on_before_destroyed(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+
+    def get_urls(self) -> List[str]:
+        urls = list(self.urls or [])
+        if self.url_file:
+            # File is read on each run, so the list of URLs could be updated without restart
+            with open(self.url_file, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        urls.append(line)
+        return urls
+
+    def obtain_state(self, trigger) -> CompositeState:
+        urls = self.get_urls()
+        results = [(None, None)] * len(urls)  # type: List[Tuple[Optional[requests.Response], Optional[Exception]]]
+        queues = {}  # type: Dict[PoolKey, Deque[int]]
+        for i, url in enumerate(urls):
+            queues.setdefault(pool_key(url), deque()).append(i)
+        # Each host is processed by at most max_per_host workers pulling URLs from the host queue, so requests
+        # waiting for a busy host don't occupy slots of the shared executor
+        futures = []
+        for queue in queues.values():
+            for _ in range(min(self.max_per_host, len(queue))):
+                futures.append(self.__executor.submit(self.__probe_queue, queue, urls, results))
+        for future in futures:
+            future.result()
+        state = CompositeState()
+        for url, (response, error) in zip(urls, results):
+            state.add(url, response, error)
+        return state
+
+    def __probe_queue(self, queue: Deque[int], urls: List[str], results: list):
+        while True:
+            try:
+                i = queue.popleft()
+            except IndexError:
+                return
+            try:
+                results[i] = (self.request(urls[i]), None)
+            except Exception as e:
+                results[i] = (None, e)
+
+    PARAMS = tuple(x for x in HttpRequest.PARAMS if x.name != "url") + (
+        ParameterDef("urls", validators=(lambda x: isinstance(x, list) and all(validators.string(u) for u in x),)),
+        ParameterDef("url_file", validators=(validators.string,)),
+        ParameterDef("max_concurrency", validators=(validators.integer,)),
+        ParameterDef("max_per_host", validators=(validators.integer,)),
     )
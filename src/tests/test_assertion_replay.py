@@ -0,0 +1,73 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common.model import WatcherModule, WatcherAssert, ValidationReporter, AssertionOutcome
+
+
+class CountingAssert(WatcherAssert):
+    calls = 0
+
+    def do_assert(self, state: dict, reporter: ValidationReporter, assertion_name: str):
+        self.calls += 1
+        reporter.error(assertion_name, "content")
+
+
+class VersionedWatcher(WatcherModule):
+    """
+    Reports the same version each run, so the outcome of the first run is replayed
+    """
+
+    def __init__(self, application):
+        super().__init__(application)
+        self.outcomes = {}
+
+    def obtain_state(self, trigger) -> dict:
+        return {"version": 1}
+
+    def serialize_state(self, state: dict) -> dict:
+        return state
+
+    def do_assertions(self, state: dict, reporter: ValidationReporter):
+        reporter.error("own")
+
+    def replay_assertions(self, state: dict):
+        return self.outcomes.get(state["version"])
+
+    def remember_assertions(self, state: dict, outcome: AssertionOutcome):
+        self.outcomes[state["version"]] = outcome
+
+
+class AssertionReplayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.application = ApplicationManager()
+        self.watcher = VersionedWatcher(self.application)
+        self.watcher.name = "versioned"
+        self.assertion = CountingAssert(self.application)
+        self.assertion.name = "counting"
+        self.watcher.custom_assertions = [self.assertion]
+
+    def tearDown(self) -> None:
+        self.application.shutdown()
+
+    def test_outcome_is_replayed(self):
+        for _ in range(3):
+            result = self.application.run_watcher(self.watcher, None)
+            self.assertEqual([x.name for x in result.assertions_failed], ["own", "counting"])
+        self.assertEqual(self.assertion.calls, 1)
@@ -0,0 +1,55 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common.model import WatcherModule, CompositeState, ValidationReporter
+
+
+class MultiTargetWatcher(WatcherModule):
+    def obtain_state(self, trigger) -> CompositeState:
+        state = CompositeState()
+        state.add("a", {"value": 1})
+        state.add("b", {"value": 2})
+        state.add("c", error=ConnectionError("refused"))
+        return state
+
+    def serialize_state(self, state: dict) -> dict:
+        return state
+
+    def do_assertions(self, state: dict, reporter: ValidationReporter):
+        if state["value"] > 1:
+            reporter.error("value")
+
+
+class CompositeStateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.application = ApplicationManager()
+        self.watcher = MultiTargetWatcher(self.application)
+        self.watcher.name = "multi"
+
+    def tearDown(self) -> None:
+        self.application.shutdown()
+
+    def test_each_target_is_reported_separately(self):
+        results = self.application.run_watcher(self.watcher, None)
+        self.assertEqual([x.extra["target"] for x in results], ["a", "b", "c"])
+        self.assertEqual([x.checks_passed for x in results], [True, False, False])
+        self.assertEqual(results[0].state, {"value": 1})
+        self.assertEqual(results[2].assertions_failed[0].name, "obtain_state")
+        self.assertEqual(results[2].assertions_failed[0].description, "refused")
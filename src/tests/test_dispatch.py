@@ -0,0 +1,152 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+from healthcheckbot.common.dispatch import (
+    DispatchQueue,
+    OutputDispatcher,
+    OutputLane,
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+)
+
+
+class DispatchQueueTest(unittest.TestCase):
+    def fill(self, queue: DispatchQueue, count: int):
+        for i in range(count):
+            queue.put(i)
+
+    def drain(self, queue: DispatchQueue):
+        result = []
+        while len(queue):
+            result.append(queue.get(0))
+        return result
+
+    def test_drop_newest_keeps_queued_items(self):
+        queue = DispatchQueue(3, OVERFLOW_DROP_NEWEST)
+        self.fill(queue, 5)
+        self.assertEqual(self.drain(queue), [0, 1, 2])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_drop_oldest_keeps_latest_items(self):
+        queue = DispatchQueue(3, OVERFLOW_DROP_OLDEST)
+        self.fill(queue, 5)
+        self.assertEqual(self.drain(queue), [2, 3, 4])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_block_waits_for_free_space(self):
+        queue = DispatchQueue(1, OVERFLOW_BLOCK)
+        queue.put("first")
+        producer = threading.Thread(target=queue.put, args=("second",))
+        producer.start()
+        producer.join(0.05)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(queue.get(0), "first")
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(queue.get(0), "second")
+        self.assertEqual(queue.max_depth, 1)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            DispatchQueue(1, "unknown")
+
+
+class OutputLaneTest(unittest.TestCase):
+    def test_flush_delivers_all_results(self):
+        delivered = []
+
+        def deliver(batch):
+            for watcher, result in batch:
+                if result == 3:
+                    raise RuntimeError("output failed")
+                delivered.append(result)
+
+        lane = OutputLane("test", deliver, queue_size=100, workers=3)
+        for i in range(10):
+            lane.submit("watcher", i)
+        self.assertTrue(lane.flush(5))
+        lane.close()
+        self.assertEqual(sorted(delivered), [0, 1, 2, 4, 5, 6, 7, 8, 9])
+        metrics = lane.get_metrics()
+        self.assertEqual(metrics["delivered"], 9)
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["queue_depth"], 0)
+
+    def test_results_are_grouped_into_batches(self):
+        batches = []
+        lane = OutputLane("test", batches.append, queue_size=100, batch_size=4, batch_linger=1)
+        for i in range(8):
+            lane.queue.put(("watcher", i))
+        lane.start()
+        self.assertTrue(lane.flush(5))
+        lane.close()
+        self.assertEqual([[r for _, r in b] for b in batches], [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+    def test_failed_batch_is_retried(self):
+        attempts = []
+
+        def deliver(batch):
+            attempts.append(batch)
+            if len(attempts) < 3:
+                raise RuntimeError("output failed")
+
+        lane = OutputLane("test", deliver, max_retries=5, retry_delay=0)
+        lane.submit("watcher", 1)
+        self.assertTrue(lane.flush(5))
+        lane.close()
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(lane.get_metrics()["retries"], 2)
+        self.assertEqual(lane.get_metrics()["delivered"], 1)
+
+
+class OutputDispatcherTest(unittest.TestCase):
+    def test_slow_and_failing_outputs_do_not_affect_others(self):
+        release = threading.Event()
+        delivered = []
+
+        def fail(batch):
+            raise RuntimeError("output failed")
+
+        dispatcher = OutputDispatcher()
+        dispatcher.add_lane(OutputLane("slow", lambda batch: release.wait(5), queue_size=100))
+        dispatcher.add_lane(OutputLane("failing", fail, queue_size=100))
+        dispatcher.add_lane(OutputLane("healthy", delivered.extend, queue_size=100))
+        for i in range(5):
+            dispatcher.submit("watcher", i)
+        self.assertTrue(dispatcher.lanes["healthy"].flush(5))
+        self.assertEqual([r for _, r in delivered], [0, 1, 2, 3, 4])
+        self.assertFalse(dispatcher.flush(0.01))
+        release.set()
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.stop()
+        metrics = dispatcher.get_metrics()
+        self.assertEqual(metrics["failing"]["failed"], 5)
+        self.assertEqual(metrics["slow"]["delivered"], 5)
+
+
+class DispatchQueueBatchTest(unittest.TestCase):
+    def test_get_batch_returns_available_items_after_linger(self):
+        queue = DispatchQueue(10)
+        queue.put(1)
+        queue.put(2)
+        self.assertEqual(queue.get_batch(5, linger=0.01), [1, 2])
+
+    def test_get_batch_returns_empty_list_on_timeout(self):
+        self.assertEqual(DispatchQueue(10).get_batch(5, timeout=0.01), [])
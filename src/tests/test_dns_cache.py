@@ -0,0 +1,79 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import socket
+import unittest
+from unittest import mock
+
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common.dns import DnsCache
+from healthcheckbot.common.model import ValidationReporter
+from healthcheckbot.contrib.celery.redis import RedisQueueSizeWatcher
+
+ADDRESS_INFO = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.1", 0))]
+
+
+class DnsCacheTest(unittest.TestCase):
+    def test_addresses_are_cached(self):
+        cache = DnsCache(ttl=60)
+        with mock.patch("socket.getaddrinfo", return_value=ADDRESS_INFO) as getaddrinfo:
+            self.assertEqual(cache.resolve("Example.com"), ["10.0.0.1"])
+            self.assertEqual(cache.resolve("example.com"), ["10.0.0.1"])
+        self.assertEqual(getaddrinfo.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired_entry_is_resolved_again(self):
+        cache = DnsCache(ttl=0)
+        with mock.patch("socket.getaddrinfo", return_value=ADDRESS_INFO) as getaddrinfo:
+            cache.resolve("example.com")
+            cache.resolve("example.com")
+        self.assertEqual(getaddrinfo.call_count, 2)
+
+    def test_failures_are_cached(self):
+        cache = DnsCache(negative_ttl=60)
+        error = socket.gaierror(-2, "Name or service not known")
+        with mock.patch("socket.getaddrinfo", side_effect=error) as getaddrinfo:
+            for _ in range(2):
+                with self.assertRaises(socket.gaierror):
+                    cache.resolve("missing.example.com")
+        self.assertEqual(getaddrinfo.call_count, 1)
+
+    def test_ip_address_is_not_resolved(self):
+        cache = DnsCache()
+        with mock.patch("socket.getaddrinfo") as getaddrinfo:
+            self.assertEqual(cache.resolve("127.0.0.1"), ["127.0.0.1"])
+            self.assertEqual(cache.resolve("::1"), ["::1"])
+        getaddrinfo.assert_not_called()
+
+
+class RedisQueueSizeWatcherTest(unittest.TestCase):
+    def test_state_is_messages_count(self):
+        watcher = RedisQueueSizeWatcher(ApplicationManager())
+        watcher.host = "redis.example.com"
+        watcher.assert_max_qty = 2
+        with mock.patch("socket.getaddrinfo", return_value=ADDRESS_INFO), mock.patch(
+            "redis.Redis.llen", return_value=3
+        ) as llen:
+            state = watcher.obtain_state(None)
+        self.assertEqual(state, 3)
+        self.assertEqual(llen.call_args[0], ("celery",))
+        serialized = watcher.serialize_state(state)
+        self.assertEqual(serialized["msg_qty"], 3)
+        self.assertIsInstance(serialized["dns_time"], float)
+        reporter = ValidationReporter(watcher, None)
+        watcher.do_assertions(state, reporter)
+        self.assertEqual([x.name for x in reporter.errors], ["max_qty_assert"])
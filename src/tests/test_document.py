@@ -0,0 +1,57 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from typing import NamedTuple
+
+from healthcheckbot.common.document import get_document
+
+
+class State:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+
+class Content(NamedTuple):
+    content: bytes
+
+
+class ParsedDocumentTest(unittest.TestCase):
+    def test_document_is_shared_by_state(self):
+        state = State(b'{"status": "ok"}')
+        document = get_document(state)
+        self.assertIs(get_document(state), document)
+        self.assertIs(document.json, document.json)
+        self.assertEqual(document.json, {"status": "ok"})
+        self.assertEqual(document.text, '{"status": "ok"}')
+
+    def test_value_is_built_once(self):
+        document = get_document(State(b""))
+        calls = []
+        for _ in range(3):
+            document.get("value", lambda: calls.append(1) or len(calls))
+        self.assertEqual(calls, [1])
+
+    def test_errors_are_cached(self):
+        document = get_document(State(b"<html>"))
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                document.json
+
+    def test_immutable_state(self):
+        state = Content(b"<title>Hello</title>")
+        self.assertEqual(get_document(state).html.title.string, "Hello")
@@ -0,0 +1,82 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import codecs
+import unittest
+
+from healthcheckbot.common.htmlscan import scan_html, ElementSelector
+
+PAGE = (
+    b"<html><head><title>Hello &amp; bye</title><meta name='Description' content='desc'>"
+    b"<meta property='og:title' content='OG' /></head><body><div id='main' class='a b'>Main <b>bold</b> "
+    b"<div>nested</div></div><p class=x>P</p><img class=logo></body></html>"
+)
+
+
+def chunks(size=7):
+    return iter([PAGE[i : i + size] for i in range(0, len(PAGE), size)])
+
+
+class HtmlScannerTest(unittest.TestCase):
+    def test_extracts_targets(self):
+        scanner = scan_html(
+            chunks(), title=True, meta=("description", "og:title"), selectors=("#main", "p.x", "img.logo")
+        )
+        self.assertEqual(scanner.title, "Hello & bye")
+        self.assertEqual(scanner.meta, {"description": "desc", "og:title": "OG"})
+        self.assertEqual(scanner.elements, {"#main": "Main bold nested", "p.x": "P", "img.logo": ""})
+
+    def test_stops_once_targets_found(self):
+        source = chunks()
+        scanner = scan_html(source, title=True)
+        self.assertTrue(scanner.done)
+        self.assertGreater(len(list(source)), 0)
+
+    def test_missing_targets(self):
+        scanner = scan_html(chunks(), title=True, meta=("keywords",), selectors=("span",))
+        self.assertFalse(scanner.done)
+        self.assertNotIn("keywords", scanner.meta)
+        self.assertNotIn("span", scanner.elements)
+
+    def test_empty_title(self):
+        self.assertIsNone(scan_html([b"<title></title>"], title=True).title)
+
+    def test_multibyte_characters_split_between_chunks(self):
+        page = "<title>Привіт</title>".encode("utf-8")
+        self.assertEqual(scan_html([page[:9], page[9:]], title=True).title, "Привіт")
+
+    def test_charset_declared_in_meta(self):
+        page = '<html><head><meta charset="windows-1251"><title>Привет</title></head></html>'.encode("cp1251")
+        self.assertEqual(scan_html([page[:10], page[10:]], title=True).title, "Привет")
+
+    def test_charset_declared_in_http_equiv(self):
+        page = (
+            '<meta http-equiv="Content-Type" content="text/html; charset=koi8-r"><title>Привет</title>'
+        ).encode("koi8-r")
+        self.assertEqual(scan_html([page], title=True).title, "Привет")
+
+    def test_header_charset_takes_precedence_over_meta(self):
+        page = '<meta charset="windows-1251"><title>Привіт</title>'.encode("utf-8")
+        self.assertEqual(scan_html([page], title=True, encoding="utf-8").title, "Привіт")
+
+    def test_byte_order_mark(self):
+        page = codecs.BOM_UTF8 + '<meta charset="windows-1251"><title>Привіт</title>'.encode("utf-8")
+        self.assertEqual(scan_html([page], title=True, encoding="windows-1251").title, "Привіт")
+
+    def test_invalid_selector(self):
+        with self.assertRaises(ValueError):
+            ElementSelector("div > p")
@@ -0,0 +1,81 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pickle
+import unittest
+
+from healthcheckbot.assertions import BodyContentAssert
+from healthcheckbot.common.http import StreamingBody, create_session, iter_body, stream_body
+from tests.http_server import LocalHttpServer
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pulled = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.pulled += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingBodyTest(unittest.TestCase):
+    def test_chunks_are_downloaded_on_demand(self):
+        response = FakeResponse([b"abc", b"def", b"ghi"])
+        body = StreamingBody(response)
+        self.assertEqual(next(body.iter_chunks()), b"abc")
+        self.assertEqual(response.pulled, 1)
+        self.assertEqual(list(body.iter_chunks()), [b"abc", b"def", b"ghi"])
+        self.assertEqual(body.read(), b"abcdefghi")
+        self.assertFalse(body.truncated)
+        self.assertFalse(response.closed)
+
+    def test_body_is_truncated(self):
+        response = FakeResponse([b"abc", b"def", b"ghi"])
+        body = StreamingBody(response, max_bytes=5)
+        self.assertEqual(body.read(), b"abcde")
+        self.assertTrue(body.truncated)
+        self.assertTrue(response.closed)
+        self.assertEqual(response.pulled, 2)
+
+    def test_iter_body_of_regular_response(self):
+        response = FakeResponse([])
+        response.content = b"abcdef"
+        self.assertEqual(list(iter_body(response, chunk_size=4)), [b"abcd", b"ef"])
+
+    def test_streamed_response_survives_pickling(self):
+        with LocalHttpServer() as server, create_session() as session:
+            response = session.get(server.url("/"), headers={"Cookie": "a=123456"}, stream=True)
+            stream_body(response, max_bytes=4)
+            copy = pickle.loads(pickle.dumps(response))
+        self.assertEqual(copy.content, b"a=12")
+        self.assertEqual(copy.text, "a=12")
+        self.assertEqual(list(iter_body(copy)), [b"a=12"])
+        self.assertTrue(copy.body.truncated)
+        self.assertEqual(copy.body.size, 4)
+        self.assertIsNotNone(copy.timings)
+
+    def test_body_text_charset_declared_in_meta(self):
+        response = FakeResponse([])
+        response.headers = {"content-type": "text/html"}
+        response.content = '<meta charset="windows-1251"><p>Привет</p>'.encode("cp1251")
+        self.assertIn("Привет", "".join(BodyContentAssert.iter_text(response)))
@@ -0,0 +1,49 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pickle
+import unittest
+
+from healthcheckbot.common.http import create_session
+from tests.http_server import LocalHttpServer
+
+
+class PhaseTimingsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = LocalHttpServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.session = create_session()
+        self.addCleanup(self.session.close)
+
+    def test_fresh_and_reused_connection(self):
+        fresh = self.session.get(self.server.url("/first")).timings
+        self.assertFalse(fresh.connection_reused)
+        self.assertGreater(fresh.connect, 0)
+        self.assertGreater(fresh.ttfb, 0)
+        reused = self.session.get(self.server.url("/second")).timings
+        self.assertTrue(reused.connection_reused)
+        self.assertEqual((reused.dns, reused.connect, reused.tls), (0, 0, 0))
+        self.assertGreater(reused.ttfb, 0)
+        self.assertAlmostEqual(reused.total, sum(reused.to_dict()[x] for x in reused.PHASES), places=5)
+
+    def test_timings_survive_pickling(self):
+        response = self.session.get(self.server.url("/"))
+        response.requested_url = self.server.url("/")
+        copy = pickle.loads(pickle.dumps(response))
+        self.assertEqual(copy.timings.to_dict(), response.timings.to_dict())
+        self.assertEqual(copy.requested_url, response.requested_url)
+        self.assertEqual(copy.status_code, 200)
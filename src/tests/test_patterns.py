@@ -0,0 +1,61 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from healthcheckbot.common.patterns import MultiPatternMatcher
+
+
+def chunks(text: str, size: int):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+class MultiPatternMatcherTest(unittest.TestCase):
+    def test_literal_patterns(self):
+        matcher = MultiPatternMatcher(["abc", "bc", "c", "missing", "Error"], ignore_case=True)
+        self.assertEqual(matcher.scan(chunks("xxabcxx error", 2)), {0, 1, 2, 4})
+
+    def test_literal_patterns_are_escaped(self):
+        matcher = MultiPatternMatcher(["a.c", "(x)"])
+        self.assertEqual(matcher.scan(["abc a.c"]), {0})
+
+    def test_regex_across_chunks(self):
+        matcher = MultiPatternMatcher([r"v\d+\.\d+", r"fail(ed|ure)"], regex=True, max_match_length=16)
+        self.assertEqual(matcher.scan(["version v1.", "2 fai", "lure"]), {0, 1})
+
+    def test_stops_when_all_found(self):
+        matcher = MultiPatternMatcher(["a"])
+        source = iter(["a", "b", "c"])
+        self.assertEqual(matcher.scan(source), {0})
+        self.assertEqual(list(source), ["b", "c"])
+
+    def test_numbered_backreferences(self):
+        matcher = MultiPatternMatcher(["x", r"(a)\1", r"(?P<q>['\"]).*(?P=q)", r"\\1"], regex=True, max_match_length=8)
+        self.assertEqual(matcher.scan(["zz a", "a zz 'q' \\1"]), {1, 2, 3})
+        self.assertEqual(MultiPatternMatcher([r"(a)\1"], regex=True).scan(["ab"]), set())
+
+    def test_anchors_are_not_matched_at_chunk_boundary(self):
+        text = " " * 16379 + "errors none, all good"
+        matcher = MultiPatternMatcher([r"\berror\b", r"good$", r"(?<=all )good"], regex=True, max_match_length=32)
+        self.assertEqual(matcher.scan(chunks(text, 16384)), {1, 2})
+        self.assertEqual(matcher.scan(chunks(text, 3)), {1, 2})
+        self.assertEqual(matcher.scan(chunks("an errors", 3)), set())
+        self.assertEqual(matcher.scan(chunks("an error", 3)), {0})
+
+    def test_patterns_which_cant_be_combined(self):
+        matcher = MultiPatternMatcher(["(?i)foo", "(?P<x>a)b", "(?P<x>c)d", "bar"], regex=True, max_match_length=8)
+        self.assertEqual(matcher.scan(chunks("xx FOO ab c", 2)), {0, 1})
@@ -0,0 +1,321 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+from uuid import UUID
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import extensions
+
+from healthcheckbot.common.model import ValidationReporter
+from healthcheckbot.contrib.postgres import (
+    ManagedConnectionPool,
+    DatabaseQueryWatcher,
+    PostgresHealthWatcher,
+    get_connection_pool,
+)
+
+
+class FakeCursor:
+    def __init__(self, connection, name=None, cursor_factory=None) -> None:
+        self.connection = connection
+        self.name = name
+        # Rows are dictionaries as with RealDictCursor unless cursor factory is given
+        self.as_tuples = cursor_factory is not None
+        self.description = [(x,) for x in connection.rows[0]] if connection.rows else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, *args):
+        if self.connection.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if "missing" in query:
+            raise psycopg2.ProgrammingError('relation "missing" does not exist')
+        if query.startswith("EXECUTE") and query[8:] not in self.connection.prepared:
+            raise psycopg2.errors.InvalidSqlStatementName("prepared statement does not exist")
+        if query.startswith("PREPARE"):
+            self.connection.prepared.add(query.split()[1])
+        self.connection.queries.append(query)
+
+    def fetchall(self):
+        return self.fetchmany(len(self.connection.rows))
+
+    def fetchone(self):
+        return self.fetchmany(1)[0]
+
+    def fetchmany(self, size):
+        rows = self.connection.rows[:size]
+        return [tuple(x.values()) for x in rows] if self.as_tuples else rows
+
+
+class FakeConnection:
+    def __init__(self, *args, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.closed = 0
+        self.broken = False
+        self.autocommit = False
+        self.queries = []
+        self.rows = [{"value": 1}]
+        self.transactions = []
+        self.prepared = set()
+        self.info = mock.Mock(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self, name, cursor_factory)
+
+    def commit(self):
+        self.transactions.append("commit")
+
+    def rollback(self):
+        self.transactions.append("rollback")
+
+    def close(self):
+        self.closed = 1
+
+
+class ManagedConnectionPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch("psycopg2.connect", side_effect=FakeConnection)
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ManagedConnectionPool(2, {"host": "/var/run/postgresql"}, validate_after=0)
+
+    def test_connections_are_opened_lazily_and_reused(self):
+        self.assertEqual(self.connect.call_count, 0)
+        with self.pool.connection() as first:
+            self.assertTrue(first.autocommit)
+        with self.pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_broken_connection_is_replaced_on_borrow(self):
+        with self.pool.connection() as first:
+            pass
+        first.broken = True
+        with self.pool.connection() as second:
+            self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_connection_broken_in_use_is_discarded(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            with self.pool.connection() as first:
+                raise psycopg2.OperationalError("connection lost")
+        self.assertTrue(first.closed)
+
+    def test_reconnect_is_postponed_after_failure(self):
+        self.connect.side_effect = psycopg2.OperationalError("could not connect to server")
+        for _ in range(2):
+            with self.assertRaises(psycopg2.OperationalError):
+                with self.pool.connection():
+                    pass
+        self.assertEqual(self.connect.call_count, 1)
+
+
+class DatabaseQueryWatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connections = []
+        self.rows = [{"value": 1}]
+        patcher = mock.patch("psycopg2.connect", side_effect=self.connect_fake)
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watcher = DatabaseQueryWatcher(None)
+        self.watcher.name = "db"
+        self.watcher.db_connection = {"host": "/var/run/postgresql"}
+        self.watcher.queries = {"first": "SELECT 1", "broken": "SELECT * FROM missing", "second": "SELECT 2"}
+
+    def connect_fake(self, *args, **kwargs) -> FakeConnection:
+        conn = FakeConnection(*args, **kwargs)
+        conn.rows = self.rows
+        self.connections.append(conn)
+        return conn
+
+    def obtain_state(self) -> dict:
+        self.watcher.validate()
+        self.watcher.compile_assertions()
+        self.watcher.on_configured()
+        self.addCleanup(self.watcher.on_before_destroyed)
+        return self.watcher.obtain_state(None)
+
+    def test_query_failure_is_reported_per_query(self):
+        state = self.obtain_state()
+        self.assertEqual(list(state), ["first", "broken", "second"])
+        self.assertEqual(state["first"].rows, [{"value": 1}])
+        self.assertIsNone(state["broken"].rows)
+        self.assertIn("missing", state["broken"].error)
+        self.assertEqual(state["second"].rows, [{"value": 1}])
+        reporter = ValidationReporter(self.watcher, None)
+        self.watcher.do_assertions(state, reporter)
+        self.assertEqual([x.name for x in reporter.errors], ["broken_query"])
+
+    def test_declarative_assertions_on_query_results(self):
+        self.watcher.assertions = [
+            {"json_path": "$.first.rows[0].value", "equals": 1},
+            {"json_path": "$.second.rows[0].value", "gt": 1, "name": "second_value"},
+            {"json_path": "$.broken.error", "exists": False},
+        ]
+        state = self.obtain_state()
+        reporter = ValidationReporter(self.watcher, None)
+        for rule in self.watcher.assertion_plan:
+            rule.check(state, reporter)
+        self.assertEqual([x.name for x in reporter.errors], ["second_value", "json_path $.broken.error"])
+
+    def test_parallel_queries(self):
+        self.watcher.parallel_queries = True
+        self.watcher.max_parallel_queries = 3
+        state = self.obtain_state()
+        self.assertEqual([x.rows for x in state.values()], [[{"value": 1}], None, [{"value": 1}]])
+
+    def test_parallelism_is_limited_by_pool(self):
+        self.watcher.parallel_queries = True
+        self.watcher.max_parallel_queries = 10
+        with self.assertRaises(ValueError):
+            self.watcher.validate()
+
+    def test_run_in_process_is_rejected(self):
+        for watcher in (self.watcher, PostgresHealthWatcher(None)):
+            watcher.run_in_process = True
+            with self.assertRaises(ValueError):
+                watcher.validate()
+
+    def test_pool_key_does_not_expose_password(self):
+        application = mock.Mock()
+        application.get_shared_resource.side_effect = lambda key, factory: key
+        params = {"host": "db", "password": "secret"}
+        key = get_connection_pool(application, params, 5, use_dns_cache=False)
+        self.assertNotIn("secret", key)
+        self.assertEqual(get_connection_pool(application, dict(params), 5, use_dns_cache=False), key)
+        self.assertNotEqual(get_connection_pool(application, {"host": "db"}, 5, use_dns_cache=False), key)
+
+    def test_bounded_query_fetches_limited_rows(self):
+        self.watcher.statement_timeout = 1.5
+        self.watcher.queries = {"items": {"sql": "SELECT value FROM items", "max_rows": 2}}
+        self.rows = [{"value": x} for x in range(5)]
+        state = self.obtain_state()
+        conn = self.connections[0]
+        self.assertEqual(state["items"].rows, [{"value": 0}, {"value": 1}])
+        self.assertTrue(state["items"].truncated)
+        self.assertEqual(conn.queries, ["SET LOCAL statement_timeout = %s", "SELECT value FROM items"])
+        self.assertEqual(conn.transactions, ["commit"])
+        self.assertTrue(conn.autocommit)
+
+    def test_failed_bounded_query_is_rolled_back(self):
+        self.watcher.queries = {"broken": {"sql": "SELECT * FROM missing", "statement_timeout": 2}}
+        state = self.obtain_state()
+        self.assertIn("missing", state["broken"].error)
+        self.assertEqual(self.connections[0].transactions, ["rollback"])
+        self.assertTrue(self.connections[0].autocommit)
+
+    def test_invalid_query_definition(self):
+        for definition in ({"query": "SELECT 1"}, {"sql": "SELECT 1", "max_rows": 0}, {"sql": "SELECT 1", "limit": 1}):
+            self.watcher.queries = {"invalid": definition}
+            with self.assertRaises(ValueError):
+                self.watcher.validate()
+
+    def test_values_are_converted_to_native_types(self):
+        self.watcher.queries = {"orders": "SELECT * FROM orders"}
+        self.rows = [
+            {
+                "id": UUID("12345678-1234-5678-1234-567812345678"),
+                "total": Decimal("10.50"),
+                "created": datetime(2020, 1, 2, 3, 4, 5),
+                "age": timedelta(minutes=1),
+                "payload": memoryview(b"\x01\xff"),
+                "tags": [Decimal("1"), "a"],
+            }
+        ]
+        state = self.watcher.serialize_state(self.obtain_state())
+        self.assertEqual(
+            state["orders"]["rows"],
+            [
+                {
+                    "id": "12345678-1234-5678-1234-567812345678",
+                    "total": 10.5,
+                    "created": "2020-01-02T03:04:05",
+                    "age": 60.0,
+                    "payload": "01ff",
+                    "tags": [1.0, "a"],
+                }
+            ],
+        )
+        json.dumps(state)
+
+    def test_columnar_result_format(self):
+        self.watcher.result_format = "columnar"
+        self.watcher.queries = {"items": "SELECT id, price FROM items"}
+        self.rows = [{"id": 1, "price": Decimal("2.5")}, {"id": 2, "price": None}]
+        state = self.watcher.serialize_state(self.obtain_state())
+        self.assertEqual(state["items"]["columns"], ["id", "price"])
+        self.assertEqual(state["items"]["rows"], [(1, 2.5), (2, None)])
+
+
+class PostgresHealthWatcherTest(unittest.TestCase):
+    METRICS = {
+        "is_replica": False,
+        "connections": 90,
+        "max_connections": 100,
+        "active_connections": 10,
+        "idle_in_transaction": 2,
+        "longest_transaction": 125.5,
+        "waiting_locks": 0,
+        "database_size": 1024,
+        "replication_lag": None,
+        "replication_lag_bytes": 4096,
+    }
+
+    def setUp(self) -> None:
+        self.connections = []
+        patcher = mock.patch("psycopg2.connect", side_effect=self.connect_fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watcher = PostgresHealthWatcher(None)
+        self.watcher.name = "db_health"
+        self.watcher.db_connection = {"host": "/var/run/postgresql"}
+        self.watcher.validate()
+        self.watcher.on_configured()
+
+    def connect_fake(self, *args, **kwargs) -> FakeConnection:
+        conn = FakeConnection(*args, **kwargs)
+        conn.rows = [dict(self.METRICS)]
+        self.connections.append(conn)
+        return conn
+
+    def test_statement_is_prepared_once_per_connection(self):
+        for _ in range(3):
+            state = self.watcher.obtain_state(None)
+        self.assertEqual(state["connection_usage"], 0.9)
+        self.assertEqual(len(self.connections), 1)
+        queries = [x.split()[0] for x in self.connections[0].queries]
+        self.assertEqual(queries, ["PREPARE", "EXECUTE", "EXECUTE", "EXECUTE"])
+        self.assertEqual(self.watcher.serialize_state(state)["replication_lag_bytes"], 4096)
+
+    def test_thresholds(self):
+        self.watcher.assert_max_connection_usage = 0.8
+        self.watcher.assert_max_transaction_duration = 300
+        self.watcher.assert_max_replication_lag = 10
+        self.watcher.assert_max_replication_lag_bytes = 1024
+        reporter = ValidationReporter(self.watcher, None)
+        self.watcher.do_assertions(self.watcher.obtain_state(None), reporter)
+        self.assertEqual([x.name for x in reporter.errors], ["connection_usage_assert", "replication_lag_bytes_assert"])
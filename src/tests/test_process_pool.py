@@ -0,0 +1,72 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from healthcheckbot.assertions import TitleAssert
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.watchers import HttpRequest
+from tests.http_server import LocalHttpServer
+
+
+class ProcessPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = LocalHttpServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.application = ApplicationManager()
+        self.application.get_instance_settings().process_pool_workers = 1
+        self.addCleanup(self.application.shutdown)
+        self.watcher = HttpRequest(self.application)
+        self.watcher.name = "page"
+        self.watcher.url = self.server.url("/page")
+        self.watcher.max_body_bytes = 1024
+        self.title_assert = TitleAssert(self.application)
+        self.title_assert.name = "title"
+        self.title_assert.expected_title = "Hello"
+        self.watcher.custom_assertions = [self.title_assert]
+
+    def run_watcher(self):
+        self.watcher.validate()
+        result = self.application.run_watcher(self.watcher, None)
+        self.assertEqual(result.assertions_failed, [])
+        return result
+
+    def test_watcher_in_process(self):
+        self.watcher.run_in_process = True
+        result = self.run_watcher()
+        self.assertEqual(result.state["status_code"], 200)
+        self.assertEqual(result.state["body_bytes_read"], 1024)
+        self.assertTrue(result.state["body_truncated"])
+        self.assertIn("timings", result.state)
+
+    def test_assertion_in_process(self):
+        self.title_assert.run_in_process = True
+        self.run_watcher()
+
+    def test_failed_assertion_in_process(self):
+        self.title_assert.run_in_process = True
+        self.title_assert.expected_title = "Bye"
+        self.watcher.validate()
+        result = self.application.run_watcher(self.watcher, None)
+        self.assertEqual([x.name for x in result.assertions_failed], ["title"])
+
+    def test_pool_is_created_once(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            pools = list(executor.map(lambda _: self.application.get_process_pool(), range(8)))
+        self.assertTrue(all(x is pools[0] for x in pools))
+        self.assertNotEqual(pools[0]._mp_context.get_start_method(), "fork")
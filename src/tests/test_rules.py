@@ -0,0 +1,127 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from healthcheckbot.common.bootstrap import _register_watcher_module, instantiate_modules_for_section
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common.error import ConfigValidationError
+from healthcheckbot.common.model import ValidationReporter, WatcherModule
+from healthcheckbot.common.rules import compile_json_path, compile_rule, compile_rules
+
+
+class Response:
+    def __init__(self, content: bytes, headers: dict = None, status_code: int = 200) -> None:
+        self.content = content
+        self.headers = headers or {}
+        self.status_code = status_code
+
+
+class RulesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.state = Response(
+            b'{"status": "ok", "items": [{"id": 1}, {"id": 2}], "a.b": 5}',
+            {"Content-Type": "application/json"},
+        )
+
+    def failures(self, *definitions) -> list:
+        reporter = ValidationReporter(None, None)
+        for rule in compile_rules(definitions):
+            rule.check(self.state, reporter)
+        return [x.name for x in reporter.errors]
+
+    def test_json_path(self):
+        self.assertEqual(compile_json_path("$.items[-1].id"), ("items", -1, "id"))
+        self.assertEqual(compile_json_path('$["a.b"]'), ("a.b",))
+        self.assertEqual(
+            self.failures(
+                {"json_path": "$.status", "equals": "ok"},
+                {"json_path": "$.items[1].id", "gte": 2, "lt": 3},
+                {"json_path": '$["a.b"]', "equals": 5},
+                {"json_path": "$.missing", "exists": False},
+            ),
+            [],
+        )
+        self.assertEqual(
+            self.failures({"json_path": "$.missing"}, {"json_path": "$.items[5]", "name": "item"}),
+            ["json_path $.missing", "item"],
+        )
+
+    def test_operators(self):
+        self.assertEqual(
+            self.failures(
+                {"header": "Content-Type", "matches": "^application/json"},
+                {"body": True, "contains": '"status"'},
+                {"body": True, "not_matches": "error"},
+                {"state": "status_code", "lt": 500, "not_equals": 204},
+            ),
+            [],
+        )
+        self.assertEqual(
+            self.failures(
+                {"header": "Content-Type", "equals": "text/html", "name": "type"},
+                {"state": "status_code", "gt": 200, "name": "status"},
+                {"json_path": "$.status", "gt": 1, "name": "not_a_number"},
+            ),
+            ["type", "status", "not_a_number"],
+        )
+
+    def test_failure_message(self):
+        reporter = ValidationReporter(None, None)
+        compile_rule({"json_path": "$.status", "equals": "fail", "critical": False}).check(self.state, reporter)
+        self.assertEqual(
+            reporter.errors[0].description, "Expected json_path $.status to be equal to 'fail' but actual is 'ok'"
+        )
+        self.assertFalse(reporter.errors[0].critical)
+
+    def test_invalid_definitions(self):
+        for definition in (
+            {"json_path": "status"},
+            {"body": True, "matches": "("},
+            {"state": "status_code", "lt": "abc"},
+            {"header": "A", "body": True},
+            {"header": "A", "unknown": 1},
+        ):
+            with self.assertRaises(ValueError):
+                compile_rule(definition)
+
+    def test_watcher_compiles_assertions(self):
+        watcher = WatcherModule(None)
+        watcher.assertions = [{"json_path": "$.status", "equals": "ok"}]
+        watcher.compile_assertions()
+        self.assertEqual([x.name for x in watcher.assertion_plan], ["json_path $.status"])
+        self.assertEqual(watcher.__getstate__()["assertion_plan"], [])
+
+
+class NoSuperValidateWatcher(WatcherModule):
+    def validate(self):
+        pass
+
+
+class BootstrapAssertionsTest(unittest.TestCase):
+    def instantiate(self, assertions: list) -> WatcherModule:
+        application = ApplicationManager()
+        config = {"w": {"provider": "tests.test_rules.NoSuperValidateWatcher", "assertions": assertions}}
+        return instantiate_modules_for_section("watchers", config, application, _register_watcher_module)[0]
+
+    def test_assertions_compiled_regardless_of_validate(self):
+        watcher = self.instantiate([{"json_path": "$.status", "equals": "ok"}])
+        self.assertEqual([x.name for x in watcher.assertion_plan], ["json_path $.status"])
+
+    def test_invalid_assertions_rejected(self):
+        with self.assertRaises(ConfigValidationError):
+            self.instantiate([{"json_path": "status"}])
@@ -0,0 +1,73 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from healthcheckbot.common.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scheduler = Scheduler()
+        self.calls = []
+
+    def test_due_calls_executed_in_deadline_order(self):
+        now = self.scheduler.time()
+        self.scheduler.call_at(now - 1, self.calls.append, "second")
+        self.scheduler.call_at(now - 2, self.calls.append, "first")
+        self.scheduler.call_at(now + 100, self.calls.append, "future")
+        delay = self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["first", "second"])
+        self.assertGreater(delay, 90)
+
+    def test_calls_with_same_deadline_keep_registration_order(self):
+        now = self.scheduler.time()
+        for i in range(5):
+            self.scheduler.call_at(now, self.calls.append, i)
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, [0, 1, 2, 3, 4])
+
+    def test_cancelled_call_is_not_executed(self):
+        call = self.scheduler.call_soon(self.calls.append, "cancelled")
+        call.cancel()
+        self.assertIsNone(self.scheduler.run_pending())
+        self.assertEqual(self.calls, [])
+
+    def test_error_in_callback_does_not_stop_processing(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        self.scheduler.call_soon(fail)
+        self.scheduler.call_soon(self.calls.append, "after")
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["after"])
+
+    def test_wait_is_interrupted_by_new_call(self):
+        timer = threading.Timer(0.05, self.scheduler.call_soon, (self.calls.append, "late"))
+        timer.start()
+        started = time.monotonic()
+        self.scheduler.wait(10)
+        self.assertLess(time.monotonic() - started, 5)
+        self.scheduler.run_pending()
+        self.assertEqual(self.calls, ["late"])
+
+    def test_wait_returns_immediately_if_woken_before(self):
+        self.scheduler.wake()
+        started = time.monotonic()
+        self.scheduler.wait(10)
+        self.assertLess(time.monotonic() - started, 1)
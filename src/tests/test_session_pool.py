@@ -0,0 +1,59 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from healthcheckbot.common.http import SessionPool
+from tests.http_server import LocalHttpServer
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = SessionPool(max_size=2, idle_timeout=60)
+        self.addCleanup(self.pool.close)
+
+    def test_sessions_are_reused_per_host(self):
+        session = self.pool.acquire("http://example.com/a")
+        self.pool.release("http://example.com/a", session)
+        self.assertIs(self.pool.acquire("http://example.com:80/b"), session)
+        self.assertIsNot(self.pool.acquire("http://example.com/a"), session)
+        self.assertIsNot(self.pool.acquire("https://example.com/a"), session)
+
+    def test_idle_sessions_are_limited(self):
+        sessions = [self.pool.acquire("http://example.com/") for _ in range(3)]
+        for session in sessions:
+            self.pool.release("http://example.com/", session)
+        self.assertEqual(
+            {self.pool.acquire("http://example.com/") for _ in range(3)} & set(sessions), set(sessions[:2])
+        )
+
+    def test_idle_sessions_are_evicted(self):
+        self.pool.idle_timeout = 0
+        session = self.pool.acquire("http://example.com/")
+        self.pool.release("http://example.com/", session)
+        self.pool.evict_idle(force=True)
+        self.assertIsNot(self.pool.acquire("http://example.com/"), session)
+
+    def test_cookies_are_not_shared_between_checks(self):
+        with LocalHttpServer() as server:
+            session = self.pool.acquire(server.url("/login"))
+            session.get(server.url("/login"))
+            self.assertEqual(session.get(server.url("/public")).text, "session=secret")
+            self.pool.release(server.url("/login"), session)
+            session = self.pool.acquire(server.url("/public"))
+            self.assertEqual(session.get(server.url("/public")).text, "")
+            self.pool.release(server.url("/public"), session)
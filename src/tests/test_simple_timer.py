@@ -0,0 +1,135 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from healthcheckbot.common.core import ApplicationManager
+from healthcheckbot.common.model import WatcherModule
+from healthcheckbot.triggers import SimpleTimer
+
+
+class SimpleTimerSpreadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.application = ApplicationManager()
+        self.timer = SimpleTimer(self.application)
+        self.timer.name = "each_minute"
+        self.timer.interval = 60
+
+    def watcher(self, name: str) -> WatcherModule:
+        watcher = WatcherModule(self.application)
+        watcher.name = name
+        return watcher
+
+    def test_offset_is_stable_and_within_interval(self):
+        offsets = [self.timer.get_spread_offset(self.watcher("watcher{}".format(i))) for i in range(100)]
+        self.assertEqual(
+            offsets, [self.timer.get_spread_offset(self.watcher("watcher{}".format(i))) for i in range(100)]
+        )
+        self.assertTrue(all(0 <= x < 60 for x in offsets))
+
+    def test_offsets_are_spread_across_interval(self):
+        offsets = [self.timer.get_spread_offset(self.watcher("watcher{}".format(i))) for i in range(600)]
+        buckets = set(int(x // 10) for x in offsets)
+        self.assertEqual(buckets, {0, 1, 2, 3, 4, 5})
+
+    def test_offset_depends_on_trigger(self):
+        other = SimpleTimer(self.application)
+        other.name = "another"
+        other.interval = 60
+        watcher = self.watcher("watcher")
+        self.assertNotEqual(self.timer.get_spread_offset(watcher), other.get_spread_offset(watcher))
+
+
+class CountingWatcher(WatcherModule):
+    def __init__(self, application, delay: float):
+        super().__init__(application)
+        self.delay = delay
+        self.runs = 0
+        self.active = 0
+        self.max_active = 0
+        self.__lock = threading.Lock()
+
+    def obtain_state(self, trigger) -> object:
+        with self.__lock:
+            self.runs += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.__lock:
+            self.active -= 1
+        return {}
+
+
+class SimpleTimerRunTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.application = ApplicationManager()
+        self.application.get_instance_settings().output_metrics_interval = 0
+        self.timer = SimpleTimer(self.application)
+        self.timer.name = "timer"
+        self.timer.interval = 0.05
+        self.loop_thread = threading.Thread(target=self.application.main_loop)
+        self.loop_thread.start()
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        self.application.shutdown()
+        self.loop_thread.join(5)
+
+    def register(self, name: str, delay: float, execution_timeout: float = 60) -> CountingWatcher:
+        watcher = CountingWatcher(self.application, delay)
+        watcher.name = name
+        watcher.execution_timeout = execution_timeout
+        self.application.get_scheduler().call_soon(self.timer.register_watcher, watcher)
+        return watcher
+
+    def test_due_jobs_run_concurrently(self):
+        self.timer.interval = 60
+        watchers = [self.register("watcher{}".format(i), 0.2) for i in range(3)]
+        # Run one after another would take 0.6s
+        time.sleep(0.4)
+        self.assertEqual([x.runs for x in watchers], [1, 1, 1])
+        self.assertEqual([x.active for x in watchers], [0, 0, 0])
+
+    def test_running_job_is_not_started_again(self):
+        watcher = self.register("slow", 0.3)
+        time.sleep(0.5)
+        self.assertIn(watcher.runs, (1, 2))
+        self.assertEqual(watcher.max_active, 1)
+
+    def test_timed_out_job_is_not_started_again_while_running(self):
+        watcher = self.register("hanging", 0.3, execution_timeout=0.02)
+        time.sleep(0.8)
+        self.assertGreaterEqual(watcher.runs, 2)
+        self.assertEqual(watcher.max_active, 1)
+
+    def test_failure_delivery_does_not_block_main_loop(self):
+        delivered = threading.Event()
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def deliver(watcher, watcher_result):
+            delivered.set()
+            # Simulates full output queue with block overflow policy
+            released.wait(5)
+
+        self.application.deliver_watcher_result = deliver
+        self.register("hanging", 0.1, execution_timeout=0.02)
+        self.assertTrue(delivered.wait(1))
+        watcher = self.register("healthy", 0)
+        time.sleep(0.3)
+        self.assertGreaterEqual(watcher.runs, 2)
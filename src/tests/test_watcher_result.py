@@ -0,0 +1,57 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+
+from healthcheckbot.common.model import WatcherResult, ValidationError, flatten_dict
+
+
+class WatcherResultTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.result = WatcherResult(
+            {"status_code": 200, "timings": {"dns": 0.1}},
+            [ValidationError("title", "Title mismatch", True)],
+            {"target": "http://example.com"},
+        )
+
+    def test_representations_are_built_once(self):
+        self.assertIs(self.result.to_dict(), self.result.to_dict())
+        self.assertIs(self.result.to_flat_dict(), self.result.to_flat_dict())
+        self.assertIs(self.result.to_json(), self.result.to_json())
+        self.assertIs(self.result.to_json_bytes(), self.result.to_json_bytes())
+
+    def test_flat_dict(self):
+        self.assertEqual(
+            self.result.to_flat_dict(),
+            {
+                "failed_assertions": [{"name": "title", "description": "Title mismatch", "critical": True}],
+                "checks_passed": 0,
+                "state__status_code": 200,
+                "state__timings__dns": 0.1,
+                "extra__target": "http://example.com",
+            },
+        )
+
+    def test_json_matches_dict(self):
+        self.assertEqual(json.loads(self.result.to_json_bytes().decode("utf-8")), self.result.to_dict())
+
+    def test_passed_result(self):
+        result = WatcherResult({"time": "00:00"}, [])
+        self.assertEqual(result.to_dict()["checks_passed"], 1)
+
+    def test_flatten_dict_with_custom_separator(self):
+        self.assertEqual(flatten_dict({"a": {"b": 1}}, sep="."), {"a.b": 1})
@@ -0,0 +1,133 @@
+#    Healthcheck Bot
+#    Copyright (C) 2018 Dmitry Berezovsky
+#
+#    HealthcheckBot is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    HealthcheckBot is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import threading
+import time
+import unittest
+
+from healthcheckbot.common.core import ApplicationManager, ENGINE_ASYNCIO, ENGINE_THREADS
+from healthcheckbot.common.error import ExecutionTimeoutError
+from healthcheckbot.common.model import (
+    AsyncOutputModule,
+    AsyncWatcherModule,
+    OutputModule,
+    WatcherModule,
+    WatcherResult,
+)
+
+
+class SleepingWatcher(WatcherModule):
+    def __init__(self, application, delay: float):
+        super().__init__(application)
+        self.delay = delay
+
+    def obtain_state(self, trigger) -> object:
+        time.sleep(self.delay)
+        return {"slept": self.delay}
+
+    def serialize_state(self, state: object) -> [dict, None]:
+        return state
+
+
+class AsyncSleepingWatcher(SleepingWatcher, AsyncWatcherModule):
+    async def obtain_state(self, trigger) -> object:
+        await asyncio.sleep(self.delay)
+        return {"slept": self.delay}
+
+
+class CollectingOutput(OutputModule):
+    def on_initialized(self):
+        self.results = []
+
+    def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
+        self.results.append(watcher_instance.name)
+
+
+class AsyncCollectingOutput(AsyncOutputModule):
+    def on_initialized(self):
+        self.results = []
+
+    async def output(self, watcher_instance: WatcherModule, watcher_result: WatcherResult):
+        await asyncio.sleep(0)
+        self.results.append(watcher_instance.name)
+
+
+class WatcherRunTests:
+    ENGINE = None
+
+    def setUp(self) -> None:
+        self.application = ApplicationManager()
+        self.application.get_instance_settings().engine = self.ENGINE
+        self.application.get_instance_settings().max_workers = 2
+        self.application.get_instance_settings().output_metrics_interval = 0
+        started = threading.Event()
+        self.application.get_scheduler().call_soon(started.set)
+        self.loop_thread = threading.Thread(target=self.application.main_loop)
+        self.loop_thread.start()
+        started.wait(1)
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        if self.loop_thread.is_alive():
+            self.application.shutdown()
+            self.loop_thread.join(5)
+
+    def watcher(self, name: str, delay: float, execution_timeout: float, clazz=SleepingWatcher) -> WatcherModule:
+        watcher = clazz(self.application, delay)
+        watcher.name = name
+        watcher.execution_timeout = execution_timeout
+        return watcher
+
+    def test_queued_runs_do_not_time_out(self):
+        # 8 runs of 0.1s on 2 workers take 0.4s, timeout counts from the start of each run
+        watchers = [self.watcher("watcher{}".format(i), 0.1, 0.3) for i in range(8)]
+        futures = [self.application.submit_watcher(x, None) for x in watchers]
+        for future in futures:
+            self.assertEqual(future.result(2).state, {"slept": 0.1})
+
+    def test_timed_out_run_completes_when_thread_is_done(self):
+        run = self.application.start_watcher_run(self.watcher("hanging", 0.3, 0.05), None)
+        with self.assertRaises(ExecutionTimeoutError):
+            run.future.result(1)
+        self.assertFalse(run.completed.done())
+        run.completed.result(1)
+
+
+class AsyncioWatcherRunTest(WatcherRunTests, unittest.TestCase):
+    ENGINE = ENGINE_ASYNCIO
+
+    def test_sync_and_async_modules(self):
+        sync_output = self.application.register_module_instance("sync_output", CollectingOutput)
+        async_output = self.application.register_module_instance("async_output", AsyncCollectingOutput)
+        watchers = [self.watcher("sync{}".format(i), 0.1, 0.3) for i in range(4)] + [
+            self.watcher("async{}".format(i), 0.1, 0.3, AsyncSleepingWatcher) for i in range(20)
+        ]
+        started = time.monotonic()
+        futures = [self.application.submit_watcher(x, None) for x in watchers]
+        for future in futures:
+            self.assertEqual(future.result(2).state, {"slept": 0.1})
+        # Async watchers don't occupy workers, 4 sync watchers on 2 workers take 0.2s
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.stop()
+        names = sorted(x.name for x in watchers)
+        self.assertEqual(sorted(sync_output.results), names)
+        self.assertEqual(sorted(async_output.results), names)
+
+
+class ThreadsWatcherRunTest(WatcherRunTests, unittest.TestCase):
+    ENGINE = ENGINE_THREADS